@@ -1,78 +1,86 @@
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from openai import OpenAI
-import json
 import time
-import re
-import random
 import os
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from avatars import AvatarThumbnails
+from completion_cache import CompletionCache, make_cache_key
+from context_builder import ContextBuilder, CONTEXT_TOKEN_BUDGET, estimate_tokens, message_tokens
+from llm_client import ResilientClient, RateLimiter, CircuitOpenError, is_retryable
+from message_store import MessageLog, SessionInUseError, DEFAULT_SESSIONS_DIR, list_sessions, is_valid_session_id
+from metrics import Metrics, STAGE_LABELS
+from post_validator import MAX_REGENERATIONS, REASON_LABELS, REPAIRED
+from rooms import RoomRegistry
+from debate_core import (
+    MODEL_NAME, TEMPERATURE, STOP_WORDS, THEME_OPTIONS, FREE_THEME, PRESET_THEMES, ROLE_AVATARS,
+    build_character_registry, classify_role, get_display_name, clean_post, preview_post,
+    pick_speaker, build_turn, build_manual_prompt, build_context, complete_post, load_pack,
+    reading_pause, format_content, make_message, make_post_check,
+)
 
 # --- 1. OpenAI APIキーの設定 (Secrets) ---
+# 1リクエストあたりのタイムアウト (秒) と、全セッション合計の同時リクエスト数・1秒あたりのリクエスト数
+REQUEST_TIMEOUT = 20.0
+MAX_CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_SECOND = 10.0
+
+@st.cache_resource
+def get_openai_client(api_key):
+    """プロセス全体で共有する OpenAI クライアント (HTTP 接続を使い回し、再試行・流量制御は ResilientClient が行う)"""
+    return ResilientClient(
+        OpenAI(api_key=api_key, max_retries=0, timeout=REQUEST_TIMEOUT),
+        max_concurrency=MAX_CONCURRENT_REQUESTS, timeout=REQUEST_TIMEOUT,
+        rate_limiter=RateLimiter(MAX_REQUESTS_PER_SECOND),
+    )
+
 try:
     OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = get_openai_client(OPENAI_API_KEY)
 except Exception:
     st.error("APIキーが設定されていません。StreamlitのSecretsを確認してください。")
     st.stop()
 
 # --- 2. データ読み込み (詳細属性・リスト/辞書完全対応) ---
-def load_characters():
-    try:
-        with open('characters.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return {item.get('id', item.get('image', f'char_{i}').split('.')[0]): item for i, item in enumerate(data)}
-        return data
-    except Exception as e:
-        st.error(f"JSON読み込みエラー: {e}")
-        st.stop()
+# キャラクター登録簿はプロセス内で1回だけ構築し、ファイル更新時のみ作り直す
+@st.cache_resource(max_entries=1)
+def load_character_registry(characters_mtime, static_mtime, themes_mtime):
+    """役職・解決済みアバター・テーマ×役職のルール表をまとめた登録簿 (debate_core.build_character_registry)"""
+    return build_character_registry('characters.json', 'static', 'themes.json')
 
-characters_data = load_characters()
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+try:
+    character_registry = load_character_registry(file_mtime('characters.json'), file_mtime('static'), file_mtime('themes.json'))
+except Exception as e:
+    st.error(f"JSON読み込みエラー: {e}")
+    st.stop()
+characters_data = character_registry["characters"]
 
 # --- 安全なアバター取得関数 (大文字小文字対応) ---
 def get_safe_avatar(char_key):
     """画像ファイルが存在すればパスを、なければ役職に応じた絵文字を返す"""
-    if char_key == "citizen":
-        return "👤"
-    
-    if char_key in characters_data:
-        char = characters_data[char_key]
-        image_name = char.get('image')
-        
-        if image_name:
-            # パターン1: そのまま探す
-            path1 = f"static/{image_name}"
-            if os.path.exists(path1):
-                return path1
-            
-            # パターン2: 先頭を大文字にして探す (french... -> French...)
-            capitalized_name = image_name[0].upper() + image_name[1:]
-            path2 = f"static/{capitalized_name}"
-            if os.path.exists(path2):
-                return path2
-    
-    # フォールバック絵文字
-    if 'louis' in char_key.lower(): return "👑"
-    if 'leo' in char_key.lower(): return "🇻🇦"
-    if 'luther' in char_key.lower(): return "✝️"
-    if 'minister' in char_key.lower(): return "📜"
-    if 'noble' in char_key.lower(): return "⚔️"
-    if 'huguenot' in char_key.lower(): return "🔨"
-    
-    return "🧑‍⚖️" 
-
-# --- 王の名前を動的に決定する関数 ---
-def get_dynamic_king_name(base_name, current_theme):
-    if "三部会" in current_theme:
-        return "ルイ13世"
-    return "ルイ14世"
-
-# --- 宰相の名前を動的に決定する関数 ---
-def get_dynamic_minister_name(base_name, current_theme):
-    if "三部会" in current_theme:
-        return "リシュリュー"
-    elif "フロンド" in current_theme:
-        return "マザラン"
-    return "王の側近"
+    entry = character_registry["entries"].get(char_key)
+    if entry:
+        return entry["avatar"]
+    return ROLE_AVATARS[classify_role(char_key)]
+
+# --- アバターの縮小版 (起動時に1回だけ作り、画像が差し替えられたときだけ作り直す) ---
+@st.cache_resource
+def get_avatar_thumbnails():
+    """全セッションで共有するアバター縮小版のキャッシュ"""
+    return AvatarThumbnails()
+
+avatar_thumbnails = get_avatar_thumbnails()
+avatar_thumbnails.refresh(character_registry["avatar_paths"])
+
+def avatar_image(avatar):
+    """吹き出しに渡すアバター (画像は縮小版のバイト列、絵文字はそのまま)"""
+    return avatar_thumbnails.get(avatar) or avatar
 
 # --- 3. 画面設定 & ハッシュタグ青色化CSS ---
 st.set_page_config(page_title="もしツイ - もしも偉人がツイートしたら", layout="wide")
@@ -96,20 +104,208 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-def format_content(text):
-    formatted_text = re.sub(r'(#\w+)', r'<span class="hashtag">\1</span>', text)
-    return formatted_text.replace('\n', '<br>')
+# --- ストリーミング生成 & 表示ペース制御 ---
+def stream_post(messages, max_tokens, placeholder, cache=None, variety=1, stats=None, check=None):
+    """トークンを受信しながら吹き出しに描画し、整形・検証済みの投稿本文と表示開始からの経過秒数を返す"""
+    stats = {} if stats is None else stats
+    stats["cache_hit"] = False
+    stats["rejections"] = []
+    cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE, max_tokens) if cache else None
+    if cache:
+        cached = cache.get(cache_key, variety)
+        if cached:
+            stats["cache_hit"] = True
+            placeholder.markdown(format_content(cached), unsafe_allow_html=True)
+            return cached, 0.0
+
+    placeholder.markdown("💭 思考中...")
+    started = time.perf_counter()
+    stream = client.chat.completions.create(model=MODEL_NAME, messages=messages, max_tokens=max_tokens, temperature=TEMPERATURE, stop=STOP_WORDS,
+                                            stream=True, stream_options={"include_usage": True})
+    raw = ""
+    first_shown = None
+    usage = None
+    for chunk in stream:
+        # include_usage を指定すると、最後に choices が空で usage だけのチャンクが届く
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if not delta:
+            continue
+        if not raw:
+            stats["first_token"] = time.perf_counter() - started
+        raw += delta
+        if any(w in raw for w in STOP_WORDS):
+            break
+        visible = preview_post(raw)
+        if visible:
+            if first_shown is None:
+                first_shown = time.time()
+            placeholder.markdown(format_content(visible) + " ▌", unsafe_allow_html=True)
+
+    stats["api"] = time.perf_counter() - started
+    clean_started = time.perf_counter()
+    clean_text = clean_post(raw)
+    if check:
+        # 140文字・ハッシュタグ・メタ発言はその場で直し、直せないものだけ空文字にして作り直させる
+        clean_text, stats["rejections"] = check(clean_text)
+    stats["clean"] = time.perf_counter() - clean_started
+    stats["prompt_tokens"] = usage.prompt_tokens if usage else message_tokens(messages)
+    stats["completion_tokens"] = usage.completion_tokens if usage else estimate_tokens(raw)
+    if clean_text:
+        placeholder.markdown(format_content(clean_text), unsafe_allow_html=True)
+        if cache:
+            cache.put(cache_key, clean_text, variety)
+    else:
+        placeholder.empty()
+    shown_for = time.time() - first_shown if first_shown else 0.0
+    return clean_text, shown_for
+
+# --- 先読み生成 (読了待ちの間に次の投稿をバックグラウンドで用意する) ---
+PREFETCH_DEPTH = 2
+
+@st.cache_resource
+def get_prefetch_executor():
+    """全セッションで共有するワーカースレッド"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+@st.cache_resource
+def get_completion_cache():
+    """全セッションで共有する生成キャッシュ (オプトイン)"""
+    return CompletionCache()
+
+# --- 計測 (所要時間・トークン数の p50/p95 をサイドバーに表示し、JSONL / Prometheus で書き出す) ---
+@st.cache_resource
+def get_metrics():
+    """全セッションで共有する計測値 (環境変数 METRICS_LOG を指定するとターンごとに JSONL へ追記する)"""
+    return Metrics(log_path=os.environ.get("METRICS_LOG"))
+
+# --- 論争パック (generate_packs.py で事前生成した論争) ---
+PACKS_DIR = "packs"
+
+@st.cache_data
+def load_pack_cached(path, mtime):
+    return load_pack(path)
+
+def list_packs():
+    if not os.path.isdir(PACKS_DIR):
+        return []
+    return sorted(f for f in os.listdir(PACKS_DIR) if f.endswith((".jsonl", ".jsonl.gz")))
+
+# API が使えないときに待つ秒数 (代替投稿も見つからなかった場合) と、論争を止めるまでの連続失敗回数
+FALLBACK_WAIT = 5.0
+MAX_CONSECUTIVE_API_ERRORS = 3
+
+def fallback_post(messages, max_tokens, char_id, theme, cache=None):
+    """API が使えないときの代替投稿: 同じプロンプトの生成キャッシュ (再利用がオンのときだけ) → 同じテーマ・発言者の論争パックの順に探す"""
+    cached = cache.get_any(make_cache_key(MODEL_NAME, messages, TEMPERATURE, max_tokens)) if cache else None
+    if cached:
+        return cached
+    candidates = []
+    for pack_file in list_packs():
+        pack_path = os.path.join(PACKS_DIR, pack_file)
+        for debate in load_pack_cached(pack_path, file_mtime(pack_path)):
+            if debate["theme"] == theme:
+                candidates += [p["content"] for p in debate["posts"] if p["role"] == char_id]
+    return random.choice(candidates) if candidates else ""
+
+# --- ルーム配信 (1つの論争を同じルームの全画面に配る) ---
+ROOM_POLL_INTERVAL = 2.0
+
+@st.cache_resource
+def get_room_registry():
+    """プロセス内で共有するルーム一覧"""
+    return RoomRegistry()
+
+# --- トーナメント (複数テーマの論争を並べて同時に進める) ---
+TOURNAMENT_MAX_THEMES = 4
+# 生成に続けて失敗したら、その論争だけを打ち切る回数
+TOURNAMENT_MAX_ERRORS = 3
+
+def new_tournament(themes, rounds):
+    """テーマごとに発言者選択・文脈の状態を別々に持つ論争を用意する"""
+    return {
+        "rounds": rounds, "running": True,
+        "debates": [{"theme": theme, "posts": [], "builder": ContextBuilder(), "job": None, "errors": 0} for theme in themes],
+    }
+
+def stop_tournament():
+    tour = st.session_state.get("tournament")
+    if tour:
+        tour["running"] = False
+        for debate in tour["debates"]:
+            if debate["job"]:
+                debate["job"]["future"].cancel()
+                debate["job"] = None
+
+def drop_prefetch():
+    """先読み済み・生成中の投稿を破棄する"""
+    for job in st.session_state.prefetch:
+        job["future"].cancel()
+    st.session_state.prefetch.clear()
 
 st.title("📱 もしツイ")
 st.subheader("〜もしも偉人がツイートしたら〜")
 
 # --- 4. セッション状態の初期化 ---
+# タイムラインに一度に表示する投稿数 (古い投稿はページャーで追加表示)
+TIMELINE_PAGE = 20
+# 投稿ログの保存先 (環境変数 SESSIONS_DIR で変えられる。ベンチマークは一時ディレクトリを使う)
+SESSIONS_DIR = os.environ.get("SESSIONS_DIR", DEFAULT_SESSIONS_DIR)
+
+def current_connection():
+    """このブラウザ接続 (Streamlit のセッション) のID。投稿ログの書き手として記録する"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def is_connection_live(connection_id):
+    """投稿ログを書いている接続がまだ生きているか (再読み込み前の画面は切断済みなので引き継げる)"""
+    return not runtime.exists() or runtime.get_instance().is_active_session(connection_id)
+
+def open_message_log(session_id=None):
+    """投稿ログを開き、URL の ?session= に今のセッションIDを載せる (開き直すと続きから読み込める)
+
+    ほかの画面が同じログに書き込み中なら SessionInUseError (開いていたログはそのまま)。
+    """
+    log = MessageLog(session_id, root=SESSIONS_DIR, factory=make_message, owner=current_connection(), is_live=is_connection_live)
+    if "messages" in st.session_state:
+        st.session_state.messages.close()
+    st.session_state.messages = log
+    st.query_params["session"] = log.session_id
+    # ルームの受信位置もログと一緒に保存しておき、開き直したときに同じ投稿を二重に追加しない
+    st.session_state.room_cursor = log.meta.get("room_cursor", {"room": None, "seq": 0})
+    # 読み込んだ投稿は前の論争として扱い、文脈の要約もやり直す
+    st.session_state.debate_start = st.session_state.messages.total
+    st.session_state.context_builder = ContextBuilder()
+
+def debate_posts():
+    """🚀 論争開始を押してからの投稿 (文脈・発言者の選択に前の論争を混ぜない)"""
+    messages = st.session_state.messages
+    return messages.recent(messages.total - st.session_state.debate_start)
+
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    session_id = st.query_params.get("session")
+    try:
+        open_message_log(session_id if is_valid_session_id(session_id) else None)
+    except SessionInUseError as e:
+        # 共有されたリンクや2つ目のタブでは、同じログに書き込まず新しいセッションで始める
+        open_message_log()
+        st.warning(f"{e}。新しいセッションで始めます。")
 if "is_running" not in st.session_state:
     st.session_state.is_running = False
 if "current_round" not in st.session_state:
     st.session_state.current_round = 0
+if "pending_post" not in st.session_state:
+    st.session_state.pending_post = None
+if "prefetch" not in st.session_state:
+    st.session_state.prefetch = deque()
+if "visible_posts" not in st.session_state:
+    st.session_state.visible_posts = TIMELINE_PAGE
+if "replay" not in st.session_state:
+    st.session_state.replay = None
+if "tournament" not in st.session_state:
+    st.session_state.tournament = None
 
 # --- 5. サイドバー (全機能維持) ---
 with st.sidebar:
@@ -117,20 +313,16 @@ with st.sidebar:
     
     st.subheader("🔁 論争の長さ")
     max_rounds = st.number_input("往復回数（総投稿数）", min_value=1, max_value=50, value=10)
+    context_budget = st.number_input("文脈のトークン上限", min_value=300, max_value=4000, value=CONTEXT_TOKEN_BUDGET, step=100,
+                                     help="1投稿の生成に送る文脈の上限。古い投稿は要約して、この範囲に収めます")
+    st.session_state.context_builder.token_budget = context_budget
     
     st.divider()
     
     st.subheader("📢 論争テーマ")
-    theme_options = [
-        "全国三部会の停止 (1614年・身分制の対立)",
-        "フロンドの乱 (1648年・貴族と高等法院の反乱)",
-        "ナントの勅令廃止 (1685年・宗教弾圧と亡命)",
-        "宗教改革 (免罪符について)", 
-        "自由テーマ (下の入力欄を使用)"
-    ]
-    selected_theme = st.selectbox("テーマ選択", theme_options)
+    selected_theme = st.selectbox("テーマ選択", THEME_OPTIONS)
     custom_theme = st.text_input("自由テーマ入力", "")
-    current_theme = custom_theme if selected_theme == "自由テーマ (下の入力欄を使用)" else selected_theme
+    current_theme = custom_theme if selected_theme == FREE_THEME else selected_theme
 
     st.divider()
     col1, col2 = st.columns(2)
@@ -138,16 +330,146 @@ with st.sidebar:
         if st.button("🚀 論争開始"):
             st.session_state.is_running = True
             st.session_state.current_round = 0 
+            # 文脈はこの論争の投稿だけから組み立て、古い投稿の要約も新しく始める
+            st.session_state.debate_start = st.session_state.messages.total
+            st.session_state.context_builder = ContextBuilder(token_budget=context_budget)
+            drop_prefetch()
+            # 同時に2つの論争を回さないよう、リーグ戦は止める
+            stop_tournament()
+            st.session_state.tournament = None
     with col2:
         if st.button("⏹️ 停止"):
             st.session_state.is_running = False
+            st.session_state.replay = None
+            # 先読み済み・生成中の投稿も捨て、止めた後に API を呼び続けないようにする
+            drop_prefetch()
+            stop_tournament()
     
     if st.button("🗑️ 履歴をリセット"):
-        st.session_state.messages = []
+        # 今までの論争はディスクに残し、新しいセッションで始め直す
+        open_message_log()
         st.session_state.is_running = False
+        st.session_state.replay = None
         st.session_state.current_round = 0
+        st.session_state.visible_posts = TIMELINE_PAGE
+        drop_prefetch()
+        stop_tournament()
+        st.session_state.tournament = None
         st.rerun()
 
+    # 前日などに保存された論争を読み込む
+    saved_sessions = [s for s in list_sessions(SESSIONS_DIR) if s["id"] != st.session_state.messages.session_id]
+    if saved_sessions:
+        with st.expander("🗂️ 保存された論争"):
+            saved_id = st.selectbox(
+                "セッション", [s["id"] for s in saved_sessions],
+                format_func=lambda sid: f"{sid[:4]}/{sid[4:6]}/{sid[6:8]} {sid[9:11]}:{sid[11:13]} ({sid})",
+            )
+            if st.button("📂 読み込む"):
+                try:
+                    open_message_log(saved_id)
+                except SessionInUseError as e:
+                    st.error(str(e))
+                else:
+                    st.session_state.is_running = False
+                    st.session_state.replay = None
+                    st.session_state.current_round = 0
+                    st.session_state.visible_posts = TIMELINE_PAGE
+                    drop_prefetch()
+                    st.rerun()
+
+    st.divider()
+
+    # 先生の画面で生成した論争を、同じルームIDの生徒の画面にそのまま配信する
+    st.subheader("📡 ルーム配信")
+    room_id = st.text_input("ルームID (空欄なら個人モード)", value=st.query_params.get("room", ""),
+                            help="URL に ?room=ルームID を付けて開くと、そのルームの視聴者として参加します").strip()
+    room = None
+    if room_id:
+        room = get_room_registry().get(room_id)
+        cursor = st.session_state.room_cursor
+        # サーバーの再起動でルームが作り直されていたら、保存していた受信位置も最初に戻す
+        if cursor["room"] != room_id or cursor["seq"] > room.read_since(cursor["seq"])[1]:
+            st.session_state.room_cursor = {"room": room_id, "seq": 0}
+        if st.checkbox("配信者 (先生) として操作する", value=st.query_params.get("host") == "1"):
+            r1, r2 = st.columns(2)
+            with r1:
+                if st.button("📡 配信開始"):
+                    room.start(client, character_registry, current_theme, max_rounds)
+            with r2:
+                if st.button("⏹️ 配信停止"):
+                    room.stop()
+        st.caption(f"状態: {room.status} ({room.generated}/{room.rounds})")
+    st.divider()
+
+    # 復習用: 複数テーマの論争を横に並べて同時に進める
+    st.subheader("🏆 トーナメント")
+    tournament_themes = st.multiselect("同時に進めるテーマ", PRESET_THEMES, default=PRESET_THEMES[:3], max_selections=TOURNAMENT_MAX_THEMES)
+    if st.button("🏆 同時に開始", disabled=len(tournament_themes) < 2):
+        st.session_state.is_running = False
+        st.session_state.replay = None
+        drop_prefetch()
+        stop_tournament()
+        st.session_state.tournament = new_tournament(tournament_themes, max_rounds)
+    st.divider()
+
+    # 事前生成した論争を API なしで再生する (generate_packs.py で作成)
+    pack_files = list_packs()
+    if pack_files:
+        st.subheader("📼 論争パック再生")
+        pack_file = st.selectbox("パック", pack_files)
+        pack_path = os.path.join(PACKS_DIR, pack_file)
+        pack = load_pack_cached(pack_path, file_mtime(pack_path))
+        debate_no = st.selectbox(
+            "論争", options=range(len(pack)),
+            format_func=lambda i: f"{i + 1}. {pack[i]['theme']} ({len(pack[i]['posts'])}投稿)",
+        )
+        if st.button("▶️ 再生") and pack:
+            st.session_state.is_running = False
+            st.session_state.replay = {"theme": pack[debate_no]["theme"], "posts": pack[debate_no]["posts"], "pos": 0}
+            drop_prefetch()
+            stop_tournament()
+            st.session_state.tournament = None
+        st.divider()
+
+    # 同じ授業を繰り返すとき用: 同一プロンプトの投稿をローカルに保存して使い回す
+    st.subheader("⚡ 生成キャッシュ")
+    use_cache = st.checkbox("生成済みの投稿を再利用する", value=False)
+    cache_variety = st.slider("バリエーション数", min_value=1, max_value=5, value=3, disabled=not use_cache,
+                              help="同じプロンプトに対して何通りの投稿をためてから使い回すか")
+    post_cache = get_completion_cache() if use_cache else None
+
+    st.divider()
+
+    # デプロイごとの性能の変化を追うための計測パネル
+    with st.expander("📊 計測 (p50 / p95)"):
+        metrics = get_metrics()
+        rows = metrics.summary()
+        if rows:
+            st.table([
+                {"段階": STAGE_LABELS[r["stage"]], "件数": r["count"], "p50 (秒)": f"{r['p50']:.3f}", "p95 (秒)": f"{r['p95']:.3f}"}
+                for r in rows
+            ])
+        else:
+            st.caption("まだ計測値がありません。")
+        counters = metrics.counters
+        st.caption(
+            f"投稿 {counters['turns']} 件 / トークン 入力 {counters['prompt_tokens']}・出力 {counters['completion_tokens']} / "
+            f"キャッシュ {counters['cache_hits']} ヒット / 作り直し {counters['empty_outputs']} 件 / "
+            f"代替投稿 {counters['fallbacks']} 件 / API 再試行 {client.stats['retries']} 回"
+        )
+        if metrics.rejections:
+            st.caption("投稿検証: " + " / ".join(
+                f"{REASON_LABELS[reason]} {'修正' if action == REPAIRED else '作り直し'} {n} 件"
+                for (reason, action), n in sorted(metrics.rejections.items())
+            ))
+        m1, m2 = st.columns(2)
+        with m1:
+            st.download_button("JSONL", metrics.to_jsonl(), file_name="metrics.jsonl", mime="application/x-ndjson")
+        with m2:
+            st.download_button("Prometheus", metrics.to_prometheus(extra={f"api_{k}": v for k, v in client.stats.items()}),
+                               file_name="metrics.prom", mime="text/plain")
+
     st.divider()
     
     # 個別投稿機能 (AI自動・手動を維持)
@@ -166,259 +488,408 @@ with st.sidebar:
     with c_manual:
         if st.button("📤 手動で投稿"):
             if user_text:
-                if selected_id == "citizen":
-                    name = "市民"
-                else:
-                    char_data = characters_data[selected_id]
-                    # 名前の動的変更ロジック
-                    if 'louis' in selected_id.lower():
-                        name = get_dynamic_king_name(char_data.get('name'), current_theme)
-                    elif 'minister' in selected_id.lower():
-                        name = get_dynamic_minister_name(char_data.get('name'), current_theme)
-                    else:
-                        name = char_data.get('name')
+                # 名前の動的変更ロジック
+                name = get_display_name(character_registry, selected_id, current_theme)
                 
                 avatar = get_safe_avatar(selected_id)
-                st.session_state.messages.append({"role": selected_id, "name": name, "content": user_text, "avatar": avatar})
+                st.session_state.messages.append(make_message(selected_id, name, user_text, avatar))
+                drop_prefetch()
                 st.rerun()
 
     with c_auto:
         if st.button("🤖 AIが自動作成"):
-            with st.spinner("AIが考案中..."):
-                role_inst = "" # 初期化
-                if selected_id == "citizen":
-                    if "三部会" in current_theme: role_inst = "【重要：あなたは貧しい市民です。王や貴族ではありません】1614年の第三身分。貴族の横暴と重税に苦しみ、王に救済を求める陳情者。"
-                    elif "フロンド" in current_theme: role_inst = "【重要：あなたは貧しい市民です】1648年のパリ市民。重税を課すマザラン枢機卿への憎悪を燃やし、バリケードを築く暴徒。"
-                    elif "ナント" in current_theme: role_inst = "【重要：あなたは市民です】1685年の市民。異端追放を歓迎するか、経済の混乱を憂う者。"
-                    elif "宗教改革" in current_theme: role_inst = "【重要：あなたは市民です】16世紀ドイツの市民。免罪符が高すぎると嘆く。"
-                    else: role_inst = "名もなき市民。野次馬。"
-                else:
-                    if 'louis' in selected_id.lower():
-                        if "三部会" in current_theme: role_inst = "13歳のルイ13世。『貴族どもは特権ばかり主張して文句が多く、本当にうざい』。三部会など時間の無駄であり、『そもそもこんなもの開かなくても、余と母上がいれば政治は回るのだ』と、議会不要論を不機嫌につぶやけ。"
-                        elif "フロンド" in current_theme: role_inst = "ルイ14世（少年期）。パリを追われた屈辱を忘れず、王権への反逆を心に刻む。"
-                        elif "ナント" in current_theme: 
-                            role_inst = "1685年のルイ14世（太陽王）。ユグノーたちが『信仰のために国を捨てる』と宣言したことに、『余の国よりも神を選ぶというのか？』と驚愕し、嘆け。そして『だが待てよ、彼らが出て行けば、フランスの富はどうなる？』と、経済崩壊の予感に震えろ。"
-                        else: role_inst = "ルイ14世（太陽王）。『朕は国家なり』。異端を許さず、フランスの統一を完成させる絶対君主。"
-                    elif 'minister' in selected_id.lower():
-                        if "三部会" in current_theme: role_inst = "リシュリュー（若き司教）。第三身分を利用して貴族を牽制する。"
-                        elif "フロンド" in current_theme: role_inst = "マザラン枢機卿。フロンド派の貴族を冷徹に計算して抑え込む。"
-                        else: role_inst = "王の側近。王の命令を冷徹に実行する。"
-                    elif 'french_noble' in selected_id.lower() or ('noble' in selected_id.lower() and 'german' not in selected_id.lower()):
-                        if "三部会" in current_theme: role_inst = "1614年のフランス貴族（名門）。第三身分が貴族を『弟』と呼んだことに激怒せよ。『靴屋の息子と兄弟になった覚えはない！』と吐き捨て、特権こそが正義だと主張せよ。"
-                        elif "フロンド" in current_theme: role_inst = "フロンド派の貴族。『王はマザランに騙されている』と主張し、武力で権力を取り戻そうとする。"
-                        else: role_inst = "ヴェルサイユの廷臣。王にへつらい、ご機嫌取りをする太鼓持ちになれ。"
-                    elif 'german_noble' in selected_id.lower():
-                        role_inst = "ドイツ諸侯。ローマへの送金を嫌い、ルターを利用して政治的自立を狙う。"
-                    elif 'huguenot' in selected_id.lower():
-                        if "ナント" in current_theme:
-                            role_inst = "1685年のユグノー（商工業者）。【重要：経済の話は一切するな】。『カトリックへの強制改宗は魂の死である』と訴えよ。『信仰を捨てるくらいなら、愛するフランスを捨てて亡命する』という悲壮な決意だけを投稿せよ。"
-                        else:
-                            role_inst = "ユグノー。信仰の自由を奪われ、亡命か改宗かの選択を迫られている。"
-                    elif 'luther' in selected_id.lower():
-                        role_inst = "マルティン・ルター。カトリックの腐敗を許さない改革者。"
-                    elif 'leo' in selected_id.lower():
-                        role_inst = "教皇レオ10世。教会の絶対権威。"
-                    else:
-                        char = characters_data[selected_id]
-                        role_inst = f"{char.get('name')}。{char.get('persona', char.get('description', ''))}"
-                
-                # メタ発言禁止
-                prompt = (
-                    f"役割: {role_inst}\n"
-                    f"タスク: テーマ『{current_theme}』について、140文字以内のSNS投稿を作成せよ。\n"
-                    "絶対ルール: 挨拶・解説・メタ発言（『不合格です』等）は一切禁止。投稿本文のみを直接出力せよ。ハッシュタグ（#）必須。"
-                )
-                
-                response = client.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role": "system", "content": prompt}], max_tokens=200, temperature=1.0, stop=["不合格", "理解しました", "申し訳", "システムエラー"])
-                ai_text = response.choices[0].message.content
-                clean_text = re.sub(r'^(不合格です|理解しました|申し訳ありません|システム上のエラー|回答は無効|この投稿は).*?\n?', '', ai_text).strip()
-
-                name = "市民" if selected_id == "citizen" else characters_data[selected_id].get('name')
-                
-                if selected_id != "citizen":
-                    if 'louis' in selected_id.lower():
-                        name = get_dynamic_king_name(characters_data[selected_id].get('name'), current_theme)
-                    elif 'minister' in selected_id.lower():
-                        name = get_dynamic_minister_name(characters_data[selected_id].get('name'), current_theme)
+            # メタ発言禁止
+            prompt = build_manual_prompt(character_registry, current_theme, selected_id)
+            
+            name = get_display_name(character_registry, selected_id, current_theme)
 
-                avatar = get_safe_avatar(selected_id)
+            avatar = get_safe_avatar(selected_id)
 
-                if clean_text:
-                    st.session_state.messages.append({"role": selected_id, "name": name, "content": clean_text, "avatar": avatar})
-                    st.rerun()
+            # 生成はメイン表示エリアの吹き出しにストリーミングする
+            st.session_state.pending_post = {"role": selected_id, "name": name, "avatar": avatar, "prompt": prompt}
 
 # --- 6. メイン表示エリア ---
-st.info(f"現在のテーマ: {current_theme} (進行状況: {st.session_state.current_round}/{max_rounds})")
+progress_info = st.empty()
+progress_info.info(f"現在のテーマ: {current_theme} (進行状況: {st.session_state.current_round}/{max_rounds})")
 message_container = st.container()
+# 最新の投稿はタイムラインの先頭に表示するため、新着用の枠を履歴より先に確保する
+live_slot = message_container.container()
+history_drawn = False
+
+def show_older_posts():
+    st.session_state.visible_posts += TIMELINE_PAGE
+
+def render_message(msg):
+    role = msg["role"]
+    avatar_path = msg["avatar"]
+    # 画像パスが存在しない場合、安全なアバターに置き換え
+    if avatar_path and avatar_path.startswith("static/") and avatar_path not in character_registry["avatar_paths"]:
+        avatar_path = get_safe_avatar(role)
+
+    with st.chat_message(role, avatar=avatar_image(avatar_path)):
+        st.write(f"**{msg['name']}** @{msg['role']}")
+        # 追加時に整形済みのHTMLを使う (古いセッションの投稿だけはここで整形)
+        st.markdown(msg.get("html") or format_content(msg["content"]), unsafe_allow_html=True)
 
 def display_messages():
+    """最新の visible_posts 件だけを1回描画し、それより古い投稿はページャーで読み込む"""
+    global history_drawn
+    if history_drawn:
+        return
+    history_drawn = True
+    messages = st.session_state.messages
+    # メモリ上の直近分より古い投稿は、ページャーで開いたときだけディスクから読む
+    visible = messages.recent(st.session_state.visible_posts)
     with message_container:
-        for msg in reversed(st.session_state.messages):
-            role = msg["role"]
-            avatar_path = msg["avatar"]
-            # 画像パスが存在しない場合、安全なアバターに置き換え
-            if avatar_path and avatar_path.startswith("static/") and not os.path.exists(avatar_path):
-                avatar_path = get_safe_avatar(role)
-
-            with st.chat_message(role, avatar=avatar_path):
-                st.write(f"**{msg['name']}** @{msg['role']}")
-                st.markdown(format_content(msg["content"]), unsafe_allow_html=True)
+        for msg in reversed(visible):
+            render_message(msg)
+        hidden = messages.total - len(visible)
+        if hidden > 0:
+            st.button(f"⬇️ さらに古い投稿を表示 (残り{hidden}件)", on_click=show_older_posts)
+
+def render_into_slot(slot, msg):
+    with slot.container():
+        render_message(msg)
+
+def stream_into_slot(slot, char_id, name, avatar, messages, max_tokens, stats=None, check=None):
+    """確保済みの枠に吹き出しを作り、生成中の投稿をストリーミング表示する"""
+    with slot.container():
+        with st.chat_message(char_id, avatar=avatar_image(avatar)):
+            st.write(f"**{name}** @{char_id}")
+            return stream_post(messages, max_tokens, st.empty(), post_cache, cache_variety, stats, check)
+
+# --- 個別投稿 (AI自動作成) のストリーミング表示 ---
+if st.session_state.pending_post:
+    post = st.session_state.pending_post
+    st.session_state.pending_post = None
+    try:
+        display_messages()
+        stats = {}
+        check = make_post_check(character_registry, current_theme, post["role"])
+        clean_text, _ = stream_into_slot(live_slot.empty(), post["role"], post["name"], post["avatar"], [{"role": "system", "content": post["prompt"]}], 200, stats, check)
+        get_metrics().record_generation(stats)
+        if clean_text:
+            st.session_state.messages.append(make_message(post["role"], post["name"], clean_text, post["avatar"]))
+            drop_prefetch()
+            st.rerun()
+        else:
+            st.warning("生成された投稿が検証を通りませんでした。もう一度お試しください。")
+    except Exception as e:
+        st.error(f"エラー: {e}")
 
 # --- 7. 自動論争ロジック (100%分離 & エラー回避 & 王・宰相名自動切替) ---
-if st.session_state.is_running:
-    if st.session_state.current_round >= max_rounds:
-        st.session_state.is_running = False
-        st.success("論争終了。")
-        st.rerun()
-    
-    char_ids = list(characters_data.keys())
-    
-    german_noble_id = next((k for k in char_ids if 'german' in k.lower()), None)
-    french_noble_id = next((k for k in char_ids if ('french' in k.lower() or 'fronde' in k.lower()) or ('noble' in k.lower() and 'german' not in k.lower())), None)
-    
-    louis_id = next((k for k in char_ids if 'louis' in k.lower()), None)
-    minister_id = next((k for k in char_ids if 'minister' in k.lower()), None)
-    huguenot_id = next((k for k in char_ids if 'huguenot' in k.lower()), None)
-    luther_id = next((k for k in char_ids if 'luther' in k.lower()), None)
-    leo_id = next((k for k in char_ids if 'leo' in k.lower()), None)
+def prefetch_turn(prev_future, history, name, system_prompt, builder, cache, variety, metrics, check):
+    """先読みワーカー: 直前の先読み投稿を待ってから文脈を組み立てて生成する (st.* は呼ばない)"""
+    if prev_future is not None:
+        history = prev_future.result()["history"]
+        if history is None:
+            return {"content": "", "history": None, "context": {}, "stats": {}}
+    report = {}
+    with metrics.timer("prompt"):
+        context = build_context(system_prompt, history, builder, report)
+    stats = {}
+    content = complete_post(client, context, 150, cache, variety, stats, check)
+    # 破棄される先読みも API の費用はかかるので、生成した時点で記録する
+    metrics.record_generation(stats)
+    if not content:
+        metrics.count("empty_outputs")
+        return {"content": "", "history": None, "context": report, "stats": stats}
+    return {"content": content, "history": history + [{"name": name, "content": content}], "context": report, "stats": stats}
+
+def fill_prefetch_queue():
+    """読了待ちの間に、次以降の発言者を既存の選択ロジックで決めて生成を先行させる"""
+    queue = st.session_state.prefetch
+    posts = debate_posts()
+    roles = [m["role"] for m in posts] + [job["role"] for job in queue]
+    history = [{"name": m["name"], "content": m["content"]} for m in posts]
+    while len(queue) < PREFETCH_DEPTH:
+        round_no = st.session_state.current_round + len(queue)
+        if round_no >= max_rounds:
+            break
+        char_id = pick_speaker(character_registry, current_theme, roles, round_no)
+        name, system_prompt = build_turn(character_registry, current_theme, char_id)
+        prev_future = queue[-1]["future"] if queue else None
+        future = get_prefetch_executor().submit(prefetch_turn, prev_future, history, name, system_prompt,
+                                                 st.session_state.context_builder, post_cache, cache_variety, get_metrics(),
+                                                 make_post_check(character_registry, current_theme, char_id))
+        queue.append({
+            "role": char_id, "name": name, "system_prompt": system_prompt, "future": future, "theme": current_theme,
+            # この件数の履歴を前提に生成しているので、手動投稿などで件数が変わったら破棄する
+            "base_len": st.session_state.messages.total + len(queue),
+        })
+        roles.append(char_id)
+
+def pop_prefetched_turn():
+    """先頭の先読み投稿を取り出す (文脈が変わっていたらキューごと破棄して None)"""
+    queue = st.session_state.prefetch
+    if not queue:
+        return None
+    job = queue[0]
+    if job["theme"] != current_theme or job["base_len"] != st.session_state.messages.total:
+        drop_prefetch()
+        return None
+    return queue.popleft()
+
+def describe_context(report):
+    """進行状況の表示に添える、今回送った文脈の内訳"""
+    if not report:
+        return "文脈 (保存済みの投稿)"
+    return (f"文脈 約{report['tokens']}トークン (要約 {report['summarized_posts']}件・そのまま {report['verbatim_posts']}件・"
+            f"省略 {report['dropped_posts']}件)")
+
+if st.session_state.is_running and room is None:
+    display_messages()
+    # 1回のスクリプト実行の中で論争を進め、新着だけを先頭の枠に追加していく (履歴は描き直さない)
+    # 枠は下から順に使うので、新しい投稿ほど上に積まれる
+    post_slots = [live_slot.empty() for _ in range(max(0, max_rounds - st.session_state.current_round))]
+
+    metrics = get_metrics()
+    # 検証で直せなかった投稿を続けて作り直した回数・API が続けて失敗した回数 (上限を超えたら論争を止める)
+    regenerations = 0
+    api_errors = 0
+    while st.session_state.is_running and st.session_state.current_round < max_rounds:
+        slot = post_slots.pop()
+        turn_started = time.perf_counter()
+        # 1投稿分の内訳 (段階ごとの秒数・トークン数) を記録する
+        record = {"theme": current_theme}
+        stats = {}
+        with metrics.timer("select", record):
+            job = pop_prefetched_turn()
+            if job:
+                current_char_id, name, system_prompt = job["role"], job["name"], job["system_prompt"]
+            else:
+                current_char_id = pick_speaker(character_registry, current_theme, [m["role"] for m in debate_posts()], st.session_state.current_round)
+                name, system_prompt = build_turn(character_registry, current_theme, current_char_id)
+        # 文脈の内訳 (トークン数・要約/そのまま/省略した投稿数)。先読みした投稿ではワーカーが組み立て済み
+        context, context_report = None, {}
+        if not job:
+            with metrics.timer("prompt", record):
+                context = build_context(system_prompt, debate_posts(), st.session_state.context_builder, context_report)
+        avatar = get_safe_avatar(current_char_id)
+        record.update(role=current_char_id, prefetched=bool(job))
 
-    last_role = st.session_state.messages[-1]["role"] if st.session_state.messages else "none"
-    
-    if st.session_state.current_round > 1 and last_role != "citizen" and (random.random() < 0.25 or st.session_state.current_round % 4 == 0):
-        current_char_id = "citizen"
-    else:
-        candidates = []
-        if "三部会" in current_theme:
-            # 【修正】三部会では「ルイ13世」「貴族」のみ（宰相リシュリューを除外）
-            candidates = [c for c in [louis_id, french_noble_id] if c]
-        elif "フロンド" in current_theme:
-            candidates = [c for c in [louis_id, minister_id, french_noble_id] if c]
-        elif "ナント" in current_theme:
-            # ナントの勅令廃止では、ルイ14世とユグノーのみ
-            candidates = [c for c in [louis_id, huguenot_id] if c]
-        elif luther_id and leo_id: 
-            candidates = [c for c in [luther_id, leo_id, german_noble_id] if c]
-        else:
-            candidates = char_ids
-
-        # ナントの勅令廃止時の特別ターン制御（宣言→嘆き）
-        if "ナント" in current_theme:
-            last_main_role = [m["role"] for m in reversed(st.session_state.messages) if m["role"] in [louis_id, huguenot_id]]
-            # まだ誰も喋ってない、または最後がルイ14世なら -> ユグノーが宣言する
-            if not last_main_role or last_main_role[0] == louis_id:
-                current_char_id = huguenot_id
-            # 最後がユグノーなら -> ルイ14世が嘆く
+        try:
+            if job:
+                with slot.container():
+                    with st.chat_message(current_char_id, avatar=avatar_image(avatar)):
+                        st.write(f"**{name}** @{current_char_id}")
+                        with st.spinner("思考中..."):
+                            with metrics.timer("prefetch_wait", record):
+                                result = job["future"].result()
+                            clean_text, context_report, stats = result["content"], result["context"], result["stats"]
+                        st.markdown(format_content(clean_text), unsafe_allow_html=True)
+                shown_for = 0.0
             else:
-                current_char_id = louis_id
-        else:
-            recent_roles = [m["role"] for m in st.session_state.messages[-2:]]
-            remaining = [c for c in candidates if c not in recent_roles]
-            current_char_id = random.choice(remaining) if remaining else random.choice(candidates)
-
-    with st.spinner(f"思考中..."):
-        # 名前決定 (AI自動投稿時)
-        if current_char_id == "citizen":
-            name = "市民のつぶやき"
-        elif 'louis' in current_char_id.lower():
-            name = get_dynamic_king_name(characters_data[current_char_id].get('name'), current_theme)
-        elif 'minister' in current_char_id.lower():
-            name = get_dynamic_minister_name(characters_data[current_char_id].get('name'), current_theme)
-        else:
-            name = characters_data[current_char_id].get('name')
-
-        # 思考回路分岐
-        if current_char_id == "citizen":
-            if "三部会" in current_theme: role_inst = "【重要：あなたは貧しい市民です。王や貴族ではありません】1614年の第三身分。貴族の横暴と重税に苦しみ、王に救済を求める陳情者。"
-            elif "フロンド" in current_theme: role_inst = "【重要：あなたは貧しい市民です】1648年のパリ市民。重税を課すマザラン枢機卿を罵り、高等法院を支持してバリケードを築け。"
-            elif "ナント" in current_theme: role_inst = "【重要：あなたは市民です】1685年の市民。異端追放を歓迎するか、経済の混乱を嘆くか叫べ。"
-            elif "宗教改革" in current_theme: role_inst = "【重要：あなたは市民です】16世紀ドイツの市民。免罪符が高すぎると嘆く。"
-            else: role_inst = "名もなき市民。"
-        
-        elif current_char_id == louis_id:
-            char = characters_data[current_char_id]
-            if "三部会" in current_theme:
-                # 【厳密化】ルイ13世の思考
-                role_inst = f"13歳のルイ13世。『貴族どもは特権ばかり主張して文句が多く、本当にうざい』。三部会など時間の無駄であり、『そもそもこんなもの開かなくても、余と母上がいれば政治は回るのだ』と、不機嫌に断言せよ。"
-            elif "フロンド" in current_theme:
-                role_inst = f"少年ルイ14世。パリの民衆に寝室まで侵入された屈辱。『王である余に対して、この無礼は何だ』と震える怒りを表現せよ。"
-            elif "ナント" in current_theme:
-                # ドラマチック・フロー（嘆き）
-                role_inst = "1685年のルイ14世（太陽王）。ユグノーたちが『信仰のために国を捨てる』と宣言したことに、『余の国よりも神を選ぶというのか？』と驚愕し、嘆け。そして『だが待てよ、彼らが出て行けば、フランスの富はどうなる？』と、経済崩壊の予感に震えろ。"
-            else: 
-                role_inst = f"絶頂期のルイ14世。『朕は国家なり』。異端を許さず、フランスの統一を完成させる絶対君主。"
-
-        elif current_char_id == minister_id:
-            char = characters_data[current_char_id]
-            if "三部会" in current_theme: role_inst = f"若きリシュリュー。第三身分を利用して貴族を牽制しつつ、王権の絶対性を説け。"
-            elif "フロンド" in current_theme: role_inst = f"マザラン枢機卿。貴族や民衆からの憎悪を一身に受けながら、冷徹に王家を守れ。"
-            else: role_inst = f"王の側近。王の命令を冷徹に実行せよ。"
-
-        elif current_char_id == french_noble_id:
-            char = characters_data[current_char_id]
-            if "三部会" in current_theme:
-                # 【厳密化】フランス貴族の思考
-                role_inst = f"1614年のフランス貴族（名門）。第三身分が貴族を『弟』と呼んだことに激怒せよ。『靴屋の息子と兄弟になった覚えはない！』と吐き捨て、特権こそが正義だと主張せよ。"
-            elif "フロンド" in current_theme: role_inst = f"フロンド派の大貴族。『マザランごとき外国人が国を牛耳るとは！』と激怒し、王を取り戻すために戦う。"
-            else: role_inst = f"ヴェルサイユの廷臣。王にへつらい、ご機嫌取りをする太鼓持ちになれ。"
-
-        elif current_char_id == german_noble_id:
-            char = characters_data[current_char_id]
-            role_inst = f"ドイツ諸侯。『ローマ教会にドイツの富が吸い上げられるのは我慢ならん』。ルターを保護し、教皇と皇帝の干渉を排除して自立を狙え。"
-
-        elif current_char_id == huguenot_id:
-            char = characters_data[current_char_id]
-            if "ナント" in current_theme:
-                # ドラマチック・フロー（宣言）
-                role_inst = "1685年のユグノー（商工業者）。【重要：経済の話は一切するな】。『カトリックへの強制改宗は魂の死である』と訴えよ。『信仰を捨てるくらいなら、愛するフランスを捨てて亡命する』という悲壮な決意だけを投稿せよ。"
+                # トークン単位で吹き出しに流し込み、stopワード・メタ発言除去は受信中のテキストにも適用する
+                check = make_post_check(character_registry, current_theme, current_char_id)
+                clean_text, shown_for = stream_into_slot(slot, current_char_id, name, avatar, context, 150, stats, check)
+                metrics.record_generation(stats)
+                if not clean_text:
+                    metrics.count("empty_outputs")
+        except Exception as e:
+            metrics.count("errors")
+            drop_prefetch()
+            if not (isinstance(e, CircuitOpenError) or is_retryable(e)):
+                # APIキーの誤り・不正なリクエスト・コードの不具合は待っても直らないので止める
+                slot.empty()
+                st.error(f"エラー: {e}")
+                st.session_state.is_running = False
+                break
+            # 再試行しても失敗した / 回路が開いている場合は、論争を止めずに保存済みの投稿で続ける
+            api_errors += 1
+            if context is None:
+                context = build_context(system_prompt, debate_posts(), st.session_state.context_builder)
+            clean_text, shown_for = fallback_post(context, 150, current_char_id, current_theme, post_cache), 0.0
+            if clean_text:
+                metrics.count("fallbacks")
+                st.toast(f"API エラーのため保存済みの投稿で続行します ({type(e).__name__})")
+                render_into_slot(slot, make_message(current_char_id, name, clean_text, avatar))
+            elif api_errors >= MAX_CONSECUTIVE_API_ERRORS:
+                slot.empty()
+                st.error(f"API エラーが{api_errors}回続いたため、論争を止めました: {e}")
+                st.session_state.is_running = False
+                break
             else:
-                role_inst = f"ユグノーの商工業者。『国のために尽くしてきたのに、なぜ追い出されねばならないのか』。経済的損失を警告せよ。"
-
-        elif current_char_id == luther_id:
-            char = characters_data[current_char_id]
-            role_inst = f"マルティン・ルター。カトリックの腐敗を激しく非難し、聖書のみを掲げよ。"
-        elif current_char_id == leo_id:
-            char = characters_data[current_char_id]
-            role_inst = f"教皇レオ10世。異端者ルターを断罪し、教会の権威を誇示せよ。"
-        
+                st.toast(f"API エラー: {e} — {FALLBACK_WAIT:.0f}秒後に再試行します")
+                slot.empty()
+                post_slots.append(slot)
+                time.sleep(FALLBACK_WAIT)
+                continue
         else:
-            char = characters_data[current_char_id]
-            role_inst = f"{char.get('name')}。{char.get('persona', char.get('description', ''))} 自説を主張せよ。"
-
-        # stopパラメータを4つに修正済み
-        system_prompt = (
-            f"### 命令: あなたは今から【{role_inst}】そのものとして振る舞い、テーマ『{current_theme}』についてSNS投稿を行います。\n"
-            "### 制約:\n"
-            "1. 140文字以内の【投稿内容のみ】を出力せよ。\n"
-            "2. 前置き、解説、相槌（『理解しました』『ありがとうございます』『不合格です』等）、AIとしてのメタ発言は一切禁止する。\n"
-            "3. なりきりを貫き、相手の意見に安易に同調しないこと。\n"
-            "4. ハッシュタグ（#）を含めよ。"
+            api_errors = 0
+
+        record.update(
+            context_tokens=context_report.get("tokens", 0), empty=not clean_text,
+            **{k: v for k, v in context_report.items() if k != "tokens"},
+            **{k: round(v, 4) if isinstance(v, float) else v for k, v in stats.items()},
         )
-        
-        context = [{"role": "system", "content": system_prompt}]
-        for m in st.session_state.messages[-4:]:
-            context.append({"role": "user", "content": f"{m['name']}: {m['content']}"})
+        if clean_text:
+            regenerations = 0
+            with metrics.timer("render", record):
+                st.session_state.messages.append(make_message(current_char_id, name, clean_text, avatar))
+                st.session_state.current_round += 1
+                progress_info.info(f"現在のテーマ: {current_theme} (進行状況: {st.session_state.current_round}/{max_rounds}) — {describe_context(context_report)}")
+            # 読んでいる間に次の投稿を生成しておく
+            fill_prefetch_queue()
+            if st.session_state.current_round < max_rounds:
+                # 固定4秒ではなく、文字数から見積もった読了時間だけ待つ
+                with metrics.timer("pause", record):
+                    time.sleep(reading_pause(clean_text, shown_for))
+        else:
+            # 検証で直せなかった投稿の先読みに続く投稿は文脈が成り立たないので破棄して作り直す
+            drop_prefetch()
+            slot.empty()
+            post_slots.append(slot)
+            regenerations += 1
+            if regenerations > MAX_REGENERATIONS:
+                st.session_state.is_running = False
+                st.warning(f"投稿の作り直しが{MAX_REGENERATIONS}回続いても検証を通らなかったため、論争を止めました。")
+        record["turn"] = round(time.perf_counter() - turn_started, 4)
+        metrics.observe("turn", record["turn"])
+        metrics.record_turn(record)
 
-        try:
-            # 修正完了: response変数の定義とstopパラメータ数
-            response = client.chat.completions.create(model="gpt-3.5-turbo", messages=context, max_tokens=150, temperature=1.0, stop=["不合格", "理解しました", "申し訳", "システムエラー"])
-            ai_text = response.choices[0].message.content
-            
-            clean_text = re.sub(r'^(不合格です|理解しました|申し訳ありません|システム上のエラー|回答は無効|この投稿は).*?\n?', '', ai_text).strip()
-            
-            avatar = get_safe_avatar(current_char_id)
+    if st.session_state.current_round >= max_rounds:
+        st.session_state.is_running = False
+        drop_prefetch()
+        st.success("論争終了。")
 
-            if clean_text:
-                st.session_state.messages.append({"role": current_char_id, "name": name, "content": clean_text, "avatar": avatar})
-                st.session_state.current_round += 1
-                display_messages()
-                time.sleep(4) 
-                st.rerun()
+# --- 論争パックの再生 (API を呼ばずに教室のペースで流す) ---
+if st.session_state.replay and room is None:
+    display_messages()
+    replay = st.session_state.replay
+    post_slots = [live_slot.empty() for _ in range(len(replay["posts"]) - replay["pos"])]
+
+    while st.session_state.replay and replay["pos"] < len(replay["posts"]):
+        post = replay["posts"][replay["pos"]]
+        msg = make_message(post["role"], post["name"], post["content"], get_safe_avatar(post["role"]))
+        render_into_slot(post_slots.pop(), msg)
+        st.session_state.messages.append(msg)
+        replay["pos"] += 1
+        progress_info.info(f"再生中のテーマ: {replay['theme']} (進行状況: {replay['pos']}/{len(replay['posts'])})")
+        if replay["pos"] < len(replay["posts"]):
+            time.sleep(reading_pause(post["content"]))
+
+    st.session_state.replay = None
+    st.success("再生終了。")
+
+# --- トーナメントの進行 (全論争の生成を並行させ、表示は1巡ずつ公平に交互に出す) ---
+def tournament_turn(history, system_prompt, builder, cache, variety, metrics, check):
+    """トーナメントの1投稿をワーカースレッドで生成する (st.* は呼ばない)"""
+    context = build_context(system_prompt, history, builder)
+    stats = {}
+    content = complete_post(client, context, 150, cache, variety, stats, check)
+    metrics.record_generation(stats)
+    if not content:
+        metrics.count("empty_outputs")
+    return content
+
+def submit_tournament_turn(debate):
+    """論争ごとの発言者選択で次の発言者を決め、生成をワーカーに投げる (流量制限は共有クライアントが守る)"""
+    posts = debate["posts"]
+    char_id = pick_speaker(character_registry, debate["theme"], [p["role"] for p in posts], len(posts))
+    name, system_prompt = build_turn(character_registry, debate["theme"], char_id)
+    history = [{"name": p["name"], "content": p["content"]} for p in posts]
+    check = make_post_check(character_registry, debate["theme"], char_id)
+    future = get_prefetch_executor().submit(tournament_turn, history, system_prompt, debate["builder"], post_cache, cache_variety, get_metrics(), check)
+    debate["job"] = {"role": char_id, "name": name, "future": future}
+
+def tournament_active(debate, tour):
+    return len(debate["posts"]) < tour["rounds"] and debate["errors"] < TOURNAMENT_MAX_ERRORS
+
+if st.session_state.tournament and room is None:
+    display_messages()
+    tour = st.session_state.tournament
+    debates = tour["debates"]
+    with live_slot.container():
+        columns = st.columns(len(debates))
+    post_slots = []
+    for column, debate in zip(columns, debates):
+        with column:
+            st.markdown(f"**{debate['theme']}**")
+            # 新しい投稿ほど上に積むため、新着用の枠を既存の投稿より先に確保する
+            post_slots.append([st.empty() for _ in range(tour["rounds"] - len(debate["posts"]))])
+            for msg in reversed(debate["posts"]):
+                render_message(msg)
+
+    if tour["running"]:
+        # 全論争の最初の生成を同時に投げておく
+        for debate in debates:
+            if tournament_active(debate, tour) and not debate["job"]:
+                submit_tournament_turn(debate)
+
+    while st.session_state.tournament is tour and tour["running"] and any(tournament_active(d, tour) for d in debates):
+        shown = []
+        # 1巡で各論争から1件ずつ、列の順に出す (速い論争だけが先に進まないようにする)
+        for i, debate in enumerate(debates):
+            if not tournament_active(debate, tour) or not debate["job"]:
+                continue
+            job = debate["job"]
+            try:
+                content = job["future"].result()
+            except Exception as e:
+                get_metrics().count("errors")
+                st.toast(f"API エラー ({debate['theme']}): {e}")
+                content = ""
+            if not content:
+                # API エラーも検証で直せなかった投稿も、続いた回数で打ち切る
+                debate["errors"] += 1
             else:
-                st.session_state.is_running = True
-                st.rerun()
-        except Exception as e:
-            st.error(f"エラー: {e}")
-            st.session_state.is_running = False
+                debate["errors"] = 0
+                msg = make_message(job["role"], job["name"], content, get_safe_avatar(job["role"]))
+                debate["posts"].append(msg)
+                render_into_slot(post_slots[i].pop(), msg)
+                shown.append(content)
+            debate["job"] = None
+            # 読んでいる間に、この論争の次の投稿を生成しておく
+            if tournament_active(debate, tour):
+                submit_tournament_turn(debate)
+
+        progress_info.info("トーナメント進行中: " + " / ".join(f"{d['theme'][:6]} {len(d['posts'])}/{tour['rounds']}" for d in debates))
+        if not shown:
+            time.sleep(FALLBACK_WAIT)
+        elif any(tournament_active(d, tour) for d in debates):
+            # 並んだ投稿を読み切れるよう、1巡のうち一番長い投稿に合わせて待つ
+            time.sleep(max(reading_pause(c) for c in shown))
+
+    if tour["running"]:
+        tour["running"] = False
+        st.success("トーナメント終了。")
+
+# --- ルーム配信の受信 (自分のカーソル以降の新着だけを先頭に追加する) ---
+@st.fragment(run_every=ROOM_POLL_INTERVAL)
+def receive_room_posts(room, room_id):
+    """ROOM_POLL_INTERVAL 秒ごとにこの部分だけを実行し直して新着を受け取る
+
+    スクリプトの中で待ち続けないので、配信が終わっても先生が次の論争を始めればそのまま受け取れる。
+    """
+    cursor = st.session_state.room_cursor
+    live = st.session_state.room_live
+    posts, last_seq = room.read_since(cursor["seq"])
+    for post in posts:
+        msg = make_message(post["role"], post["name"], post["content"], get_safe_avatar(post["role"]))
+        st.session_state.messages.append(msg)
+        live.append(msg)
+    if posts:
+        cursor["seq"] = last_seq
+        st.session_state.messages.meta["room_cursor"] = dict(cursor)
+        st.session_state.messages.save_meta()
+    if len(live) > TIMELINE_PAGE:
+        # 新着がたまったら全体を描き直して履歴側に回し、この部分で毎回描く投稿数を抑える
+        st.rerun()
+    if room.status in ("idle", "running"):
+        st.info(f"ルーム「{room_id}」: {room.theme or '配信待ち'} (進行状況: {room.generated}/{room.rounds})")
+    else:
+        st.info(f"ルーム「{room_id}」: {room.theme} の配信は終了しました ({room.generated}/{room.rounds}) — 次の配信を待っています")
+    for msg in reversed(live):
+        render_message(msg)
+
+if room is not None:
+    display_messages()
+    # 履歴に描いた投稿より後の新着だけを、タイムライン先頭の受信部分に積む
+    st.session_state.room_live = []
+    progress_info.empty()
+    with live_slot:
+        receive_room_posts(room, room_id)
 
-if not st.session_state.is_running:
+if not history_drawn:
     display_messages()
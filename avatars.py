@@ -0,0 +1,69 @@
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+# --- アバター画像の縮小版 (プロセス内で1回だけ作り、全セッションで使い回す) ---
+# st.chat_message にファイルパスを渡すと、投稿ごと・再実行ごとに元の JPEG を読み直して送ることになる。
+# 表示サイズに合わせた正方形の縮小版をバイト列で持っておき、それを渡す。
+# Streamlit はアバターを JPEG/PNG/GIF 以外で受け取ると毎回変換し直すので、WebP ではなく
+# 透過のない画像は JPEG、透過のある画像は PNG で作る。
+
+# チャットのアバターは 32px 前後で表示されるので、高解像度の画面でもぼやけない2倍で作る
+AVATAR_SIZE = 64
+AVATAR_QUALITY = 85
+
+def make_thumbnail(data, size=AVATAR_SIZE):
+    """画像のバイト列を中央で正方形に切り抜いて縮小し、JPEG (透過があれば PNG) のバイト列で返す"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        thumb = ImageOps.fit(image.convert("RGBA" if has_alpha else "RGB"), (size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    if has_alpha:
+        thumb.save(out, "PNG", optimize=True)
+    else:
+        thumb.save(out, "JPEG", quality=AVATAR_QUALITY, optimize=True)
+    return out.getvalue()
+
+class AvatarThumbnails:
+    """アバター画像のパス → 縮小版のバイト列 (元画像の内容ハッシュが変わったときだけ作り直す)"""
+
+    def __init__(self, size=AVATAR_SIZE):
+        self.size = size
+        self._by_path = {}    # パス → (更新時刻, ファイルサイズ, 内容ハッシュ)
+        self._by_digest = {}  # 内容ハッシュ → 縮小版 (同じ画像を使うキャラクターは1つを共有する)
+        self._lock = threading.Lock()
+
+    def refresh(self, paths):
+        """更新時刻・サイズが変わったファイルだけ読み直し、内容が変わっていれば縮小版を作り直す"""
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = self._by_path.get(path)
+            if entry and entry[:2] == (stat.st_mtime, stat.st_size):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            with self._lock:
+                if digest not in self._by_digest:
+                    try:
+                        self._by_digest[digest] = make_thumbnail(data, self.size)
+                    except OSError:
+                        # 画像として読めないファイルは縮小せず、パスのまま表示させる
+                        continue
+                self._by_path[path] = (stat.st_mtime, stat.st_size, digest)
+                # 差し替えで使われなくなった縮小版は捨てる
+                live = {e[2] for e in self._by_path.values()}
+                for old in [d for d in self._by_digest if d not in live]:
+                    del self._by_digest[old]
+
+    def get(self, path):
+        """縮小版のバイト列 (未登録のパスなら None)"""
+        entry = self._by_path.get(path)
+        return self._by_digest.get(entry[2]) if entry else None
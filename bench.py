@@ -0,0 +1,208 @@
+"""論争ループのベンチマーク (ローカルの代役サーバ相手に、API の費用なしで計測する)
+
+発言者選択 → 文脈組み立て → ストリーミング受信と整形 → 投稿の追加 を、app.py の自動論争と同じ
+debate_core の関数で回し、往復数 × 同時セッション数ごとにスループット・1往復の所要時間・
+セッション状態のメモリ増加を表にする。--apptest では app.py そのものを Streamlit の AppTest で動かす。
+
+    python bench.py                                          # 1/10/50 往復 × 1/10 セッション
+    python bench.py --rounds 10 --sessions 1 5 20 --latency 0.5 --error-rate 0.05
+    python bench.py --apptest --rounds 1 10 --sessions 1 3   # 画面込み (読了待ちは0秒にする)
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import debate_core
+from context_builder import ContextBuilder
+from debate_core import (
+    MODEL_NAME, TEMPERATURE, STOP_WORDS, PRESET_THEMES, ROLE_AVATARS, build_character_registry,
+    pick_speaker, build_turn, build_context, clean_post, preview_post, format_content, make_message, make_post_check,
+)
+from fake_openai_server import start_server
+from message_store import MessageLog
+from metrics import percentile
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+# AppTest で計測するセッション状態 (app.py のセクション4で初期化しているもの)
+APP_STATE_KEYS = ["messages", "prefetch", "visible_posts", "replay", "room_cursor", "context_builder"]
+# 検証で直せなかった投稿・API エラーが続いたときに、1セッションで諦めるまでの試行回数 (往復数の倍数)
+MAX_ATTEMPTS_PER_ROUND = 3
+
+def deep_sizeof(obj, seen=None):
+    """オブジェクトが参照している先まで含めたおおよそのバイト数"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+# --- 画面なし: app.py の自動論争 (ストリーミング表示) と同じ手順を debate_core の関数で回す ---
+def stream_headless(client, messages, max_tokens, check):
+    """stream_post と同じく、受信しながら途中表示用に整形し、最後に検証済みの投稿本文を返す"""
+    stream = client.chat.completions.create(model=MODEL_NAME, messages=messages, max_tokens=max_tokens, temperature=TEMPERATURE,
+                                            stop=STOP_WORDS, stream=True, stream_options={"include_usage": True})
+    raw = ""
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        raw += chunk.choices[0].delta.content or ""
+        if any(w in raw for w in STOP_WORDS):
+            break
+        visible = preview_post(raw)
+        if visible:
+            format_content(visible)
+    return check(clean_post(raw))[0]
+
+def run_session(client, registry, theme, rounds, seed, sessions_dir):
+    """1セッション分の論争を最後まで回し、1往復ごとの所要時間とセッション状態の大きさを返す"""
+    rng = random.Random(seed)
+    # app.py と同じく、投稿は直近だけをメモリに持つ投稿ログに積む (全件は一時ディレクトリに書く)
+    messages = MessageLog(root=sessions_dir, factory=make_message)
+    state = {"messages": messages, "current_round": 0, "context_builder": ContextBuilder()}
+    start_bytes = deep_sizeof(state)
+    latencies = []
+    empty = errors = 0
+    for _ in range(rounds * MAX_ATTEMPTS_PER_ROUND):
+        if state["current_round"] >= rounds:
+            break
+        started = time.perf_counter()
+        char_id = pick_speaker(registry, theme, [m["role"] for m in state["messages"]], state["current_round"], rng)
+        name, system_prompt = build_turn(registry, theme, char_id)
+        context = build_context(system_prompt, state["messages"], state["context_builder"])
+        try:
+            clean_text = stream_headless(client, context, 150, make_post_check(registry, theme, char_id))
+        except Exception:
+            errors += 1
+            continue
+        if not clean_text:
+            empty += 1
+            continue
+        entry = registry["entries"].get(char_id)
+        avatar = entry["avatar"] if entry else ROLE_AVATARS["citizen"]
+        state["messages"].append(make_message(char_id, name, clean_text, avatar))
+        state["current_round"] += 1
+        latencies.append(time.perf_counter() - started)
+    return {"posts": state["current_round"], "latencies": latencies, "empty": empty, "errors": errors,
+            "start_bytes": start_bytes, "end_bytes": deep_sizeof(state)}
+
+# --- 画面込み: app.py を AppTest で動かす ---
+def run_apptest_session(rounds, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.secrets["OPENAI_API_KEY"] = "bench"
+    at.run()
+    start_bytes = deep_sizeof({k: at.session_state[k] for k in APP_STATE_KEYS if k in at.session_state})
+    at.sidebar.number_input[0].set_value(rounds)
+    start_button = next(b for b in at.sidebar.button if b.label == "🚀 論争開始")
+    start_button.click().run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return {"posts": len(at.session_state.messages), "latencies": [], "empty": 0, "errors": 0, "start_bytes": start_bytes,
+            "end_bytes": deep_sizeof({k: at.session_state[k] for k in APP_STATE_KEYS if k in at.session_state})}
+
+def read_turn_log(path, offset):
+    """METRICS_LOG に追記されたターンの記録を offset から読み、(1往復の秒数のリスト, 新しい offset) を返す"""
+    with open(path, encoding="utf-8") as f:
+        f.seek(offset)
+        turns = [json.loads(line) for line in f if line.strip()]
+        return [t["turn"] - t.get("pause", 0.0) for t in turns if not t.get("empty")], f.tell()
+
+# --- 実行と集計 ---
+def run_scenario(rounds, sessions, runner):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(runner, range(sessions)))
+    wall = time.perf_counter() - started
+    posts = sum(r["posts"] for r in results)
+    latencies = [x for r in results for x in r["latencies"]]
+    growth = [r["end_bytes"] - r["start_bytes"] for r in results]
+    return {
+        "rounds": rounds, "sessions": sessions, "posts": posts, "wall": round(wall, 3),
+        "throughput": round(posts / wall, 2) if wall else 0.0,
+        "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+        "empty": sum(r["empty"] for r in results), "errors": sum(r["errors"] for r in results),
+        "state_kb": round(sum(r["end_bytes"] for r in results) / len(results) / 1024, 1),
+        "growth_per_post": round(sum(growth) / posts) if posts else 0,
+    }
+
+def format_row(row):
+    ms = lambda v: f"{v * 1000:8.1f}" if v is not None else "       -"
+    return (f"{row['rounds']:>5} {row['sessions']:>6} {row['posts']:>6} {row['wall']:>8.2f} {row['throughput']:>9.2f} "
+            f"{ms(row['p50'])} {ms(row['p95'])} {row['empty']:>4} {row['errors']:>4} {row['state_kb']:>9.1f} {row['growth_per_post']:>8}")
+
+HEADER = "往復   セッション 投稿数   秒数   投稿/秒  p50(ms)  p95(ms)  空  エラー 状態(KB)  B/投稿"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="論争ループをローカルの代役サーバ相手に計測する")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[1, 10, 50], help="1論争あたりの往復数 (1〜50)")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10], help="同時に動かすセッション数")
+    parser.add_argument("--theme", default=PRESET_THEMES[0])
+    parser.add_argument("--latency", type=float, default=0.3, help="代役サーバが応答を返し始めるまでの秒数")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="代役サーバの生成速度 (トークン/秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="代役サーバが 429/500 を返す割合")
+    parser.add_argument("--apptest", action="store_true", help="app.py を Streamlit の AppTest で動かす (画面込み)")
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server, base_url = start_server(latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate, seed=args.seed)
+    print(f"代役サーバ: {base_url} (応答 {args.latency}秒 / {args.token_rate}トークン/秒 / エラー率 {args.error_rate})")
+
+    sessions_dir = tempfile.mkdtemp(prefix="bench-sessions-")
+    if args.apptest:
+        # app.py は OPENAI_BASE_URL を見て代役サーバにつなぐ。読了待ちは計測の邪魔なので0秒にする
+        os.environ["OPENAI_BASE_URL"] = base_url
+        log_path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "turns.jsonl")
+        os.environ["METRICS_LOG"] = log_path
+        # 計測で作った論争が「保存された論争」の一覧に混ざらないよう、投稿ログは一時ディレクトリに書く
+        os.environ["SESSIONS_DIR"] = sessions_dir
+        open(log_path, "w").close()
+        debate_core.reading_pause = lambda text, shown_for=0.0: 0.0
+        log_offset = 0
+    else:
+        from openai import OpenAI
+        from llm_client import ResilientClient
+        client = ResilientClient(OpenAI(api_key="bench", base_url=base_url, max_retries=0), max_concurrency=64, base_delay=0.05)
+        registry = build_character_registry()
+
+    rows = []
+    print(HEADER)
+    for rounds in args.rounds:
+        for sessions in args.sessions:
+            if args.apptest:
+                timeout = 30 + rounds * (args.latency + 5)
+                row = run_scenario(rounds, sessions, lambda i: run_apptest_session(rounds, timeout))
+                latencies, log_offset = read_turn_log(log_path, log_offset)
+                row.update(p50=percentile(latencies, 0.5), p95=percentile(latencies, 0.95))
+            else:
+                row = run_scenario(rounds, sessions, lambda i: run_session(client, registry, args.theme, rounds, args.seed * 1000 + i, sessions_dir))
+            rows.append(row)
+            print(format_row(row))
+    print(f"代役サーバへのリクエスト {server.stats['requests']} 件 (うちエラー応答 {server.stats['errors']} 件)")
+    server.shutdown()
+    shutil.rmtree(sessions_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
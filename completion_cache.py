@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# --- 生成済み投稿のローカルキャッシュ (SQLite) ---
+# 同じテーマ・同じキャラクターで授業を繰り返すと、全く同じプロンプトが何度も送られる。
+# モデル・メッセージ・temperature・max_tokens のハッシュをキーに、生成済みの投稿を保存しておく。
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "completions.sqlite3")
+
+def make_cache_key(model, messages, temperature, max_tokens):
+    """リクエスト内容からキャッシュキー (SHA-256) を作る"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CompletionCache:
+    """キーごとに最大 variety 件の投稿を保持し、そこから無作為に返すキャッシュ"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_keys=5000, ttl_seconds=14 * 24 * 3600):
+        self.path = path
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamlit のセッション間・先読みスレッド間で共有するため、接続は1本にしてロックで守る
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS variants ("
+                " key TEXT NOT NULL, text TEXT NOT NULL, created REAL NOT NULL,"
+                " PRIMARY KEY (key, text))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS keys_last_used ON keys (last_used)")
+
+    def get(self, key, variety=1):
+        """variety 件そろっていれば1件を無作為に返す。そろっていなければ None (新規生成して put する)"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM variants WHERE key = ? AND created >= ?", (key, now - self.ttl_seconds)
+            ).fetchall()
+            if len(rows) < max(1, variety):
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE keys SET last_used = ? WHERE key = ?", (now, key))
+        return random.choice(rows)[0]
+
+    def get_any(self, key):
+        """件数に関係なく保存済みの投稿を1件返す (API が使えないときの代替用)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT text FROM variants WHERE key = ?", (key,)).fetchall()
+        return random.choice(rows)[0] if rows else None
+
+    def put(self, key, text, variety=1):
+        """投稿を保存し、キーごとの件数・有効期限・総キー数の上限を超えた分を捨てる"""
+        if not text:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO variants (key, text, created) VALUES (?, ?, ?)", (key, text, now))
+            self._conn.execute("INSERT OR REPLACE INTO keys (key, last_used) VALUES (?, ?)", (key, now))
+            # キー内は新しい順に variety 件だけ残す
+            self._conn.execute(
+                "DELETE FROM variants WHERE key = ? AND rowid NOT IN ("
+                " SELECT rowid FROM variants WHERE key = ? ORDER BY created DESC LIMIT ?)",
+                (key, key, max(1, variety)),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        """期限切れの投稿と、最近使われていないキー (LRU) を削除する"""
+        self._conn.execute("DELETE FROM variants WHERE created < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM keys WHERE key NOT IN (SELECT key FROM keys ORDER BY last_used DESC LIMIT ?)",
+            (self.max_keys,),
+        )
+        self._conn.execute("DELETE FROM variants WHERE key NOT IN (SELECT key FROM keys)")
+        self._conn.execute("DELETE FROM keys WHERE key NOT IN (SELECT DISTINCT key FROM variants)")
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM variants")
+            self._conn.execute("DELETE FROM keys")
+
+    def stats(self):
+        with self._lock:
+            keys = self._conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+            variants = self._conn.execute("SELECT COUNT(*) FROM variants").fetchone()[0]
+        return {"keys": keys, "variants": variants}
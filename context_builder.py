@@ -0,0 +1,146 @@
+import re
+import threading
+
+# --- 生成に送る文脈の組み立て (トークン予算つき) ---
+# 直近の投稿はそのまま送り、それより古い投稿は発言者ごとの要約にまとめる。
+# 要約は SUMMARY_EVERY 投稿ごとにだけ更新し、途中までの要約を使い回して差分だけ畳み込む。
+# 50往復の長い論争でも、送るトークン数 (= 待ち時間) が予算を超えて伸びないようにする。
+
+CONTEXT_TOKEN_BUDGET = 1000
+KEEP_RECENT = 4
+SUMMARY_EVERY = 5
+SUMMARY_TOKEN_LIMIT = 200
+SUMMARY_LINE_CHARS = 40
+SUMMARY_HASHTAGS = 10
+
+HASHTAG_PATTERN = re.compile(r'#[^\s#]+')
+SENTENCE_PATTERN = re.compile(r'[^。！？!?\n]+[。！？!?]*')
+
+def estimate_tokens(text):
+    """おおよそのトークン数 (英数字は4文字で1トークン、日本語はほぼ1文字1トークンとして数える)"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def message_tokens(messages):
+    """messages 全体のおおよそのトークン数 (1メッセージごとに役割などの固定分4トークンを足す)"""
+    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
+
+def split_post(text):
+    """投稿を文のリストとハッシュタグのリストに分ける"""
+    tags = HASHTAG_PATTERN.findall(text)
+    body = HASHTAG_PATTERN.sub(' ', text)
+    return [s.strip() for s in SENTENCE_PATTERN.findall(body) if s.strip()], tags
+
+def fold_posts(state, posts):
+    """要約の状態に投稿を畳み込んだ新しい状態を返す (元の状態は書き換えない)"""
+    speakers = dict(state["speakers"])
+    hashtags = dict(state["hashtags"])
+    for post in posts:
+        sentences, tags = split_post(post["content"])
+        prev = speakers.pop(post["name"], {"count": 0, "stance": ""})
+        stance = sentences[0][:SUMMARY_LINE_CHARS] if sentences else prev["stance"]
+        # 発言順を保つため、最後に喋った人ほど後ろに並べ直す
+        speakers[post["name"]] = {"count": prev["count"] + 1, "stance": stance}
+        for tag in tags:
+            hashtags[tag] = hashtags.pop(tag, 0) + 1
+    return {"speakers": speakers, "hashtags": hashtags}
+
+EMPTY_SUMMARY = {"speakers": {}, "hashtags": {}}
+
+def render_summary(state, exclude_tags=(), token_limit=SUMMARY_TOKEN_LIMIT):
+    """要約の状態を1つのテキストにする (上限を超える分は古い発言者から削る)"""
+    lines = [f"- {name} ({s['count']}回): {s['stance']}" for name, s in state["speakers"].items()]
+    tags = [t for t in state["hashtags"] if t not in exclude_tags][-SUMMARY_HASHTAGS:]
+    footer = [f"既出のハッシュタグ: {' '.join(tags)}"] if tags else []
+    while lines:
+        text = "\n".join(["これまでの論争の要約:"] + lines + footer)
+        if estimate_tokens(text) <= token_limit:
+            return text
+        lines.pop(0)
+    return ""
+
+class ContextBuilder:
+    """システムプロンプト + 要約 + 直近の投稿 を予算内で組み立てる (セッションごとに1つ持つ)"""
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, keep_recent=KEEP_RECENT, summary_every=SUMMARY_EVERY,
+                 summary_limit=SUMMARY_TOKEN_LIMIT, max_memo=32):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summary_every = summary_every
+        self.summary_limit = summary_limit
+        self.max_memo = max_memo
+        # 要約済みの投稿列 → 要約の状態 (先読みの仮の履歴で作った要約も、投稿列が一致する限り使い回す)
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def _summary_state(self, history, boundary):
+        """先頭 boundary 件の要約の状態 (SUMMARY_EVERY 件単位で、手元にある一番近い要約から差分だけ畳み込む)"""
+        state, start = EMPTY_SUMMARY, 0
+        # キーは「先頭 b 件」の投稿列そのものなので、履歴が食い違えば別の要約として扱われる
+        keys = [(b, tuple((p["name"], p["content"]) for p in history[:b]))
+                for b in range(self.summary_every, boundary + 1, self.summary_every)]
+        with self._lock:
+            for i in range(len(keys) - 1, -1, -1):
+                if keys[i] in self._memo:
+                    state, start = self._memo[keys[i]], keys[i][0]
+                    break
+        for b, key in keys:
+            if b <= start:
+                continue
+            state = fold_posts(state, history[start:b])
+            start = b
+            with self._lock:
+                self._memo[key] = state
+                while len(self._memo) > self.max_memo:
+                    self._memo.pop(next(iter(self._memo)))
+        return state
+
+    def build(self, system_prompt, history, report=None):
+        """生成に送る messages を組み立てる (report に辞書を渡すと、送ったトークン数と投稿の内訳を書き込む)
+
+        先読みのワーカーも同じ builder を使うので、内訳は builder には持たせず呼び出しごとに返す。
+        """
+        context = [{"role": "system", "content": system_prompt}]
+        boundary = max(0, (len(history) - self.keep_recent) // self.summary_every * self.summary_every)
+        recent = history[boundary:]
+
+        # 直近の投稿は新しい順に見て、既出の文・ハッシュタグを落としてから予算内で詰める
+        seen_sentences, seen_tags = set(), set()
+        deduped = []
+        for post in reversed(recent):
+            sentences, tags = split_post(post["content"])
+            kept = [s for s in sentences if s not in seen_sentences]
+            if not kept:
+                # 新しい文のない投稿 (同じ主張の繰り返し) は送らない
+                continue
+            kept_tags = [t for t in dict.fromkeys(tags) if t not in seen_tags]
+            seen_sentences.update(kept)
+            seen_tags.update(kept_tags)
+            deduped.append({"role": "user", "content": f"{post['name']}: {''.join(kept)} {' '.join(kept_tags)}".rstrip()})
+
+        summary = ""
+        if boundary:
+            summary = render_summary(self._summary_state(history, boundary), seen_tags, self.summary_limit)
+        if summary:
+            context.append({"role": "system", "content": summary})
+
+        remaining = self.token_budget - message_tokens(context)
+        posts = []
+        for message in deduped:
+            cost = message_tokens([message])
+            # 予算が足りなくても最新の1件だけは必ず送る
+            if posts and cost > remaining:
+                break
+            posts.append(message)
+            remaining -= cost
+        context += reversed(posts)
+
+        if report is not None:
+            report.update(
+                tokens=message_tokens(context),
+                summary_tokens=estimate_tokens(summary),
+                summarized_posts=boundary,
+                verbatim_posts=len(posts),
+                dropped_posts=len(recent) - len(posts),
+            )
+        return context
@@ -0,0 +1,334 @@
+import gzip
+import json
+import os
+import random
+import re
+import time
+
+from completion_cache import make_cache_key
+from context_builder import ContextBuilder, estimate_tokens, message_tokens
+from message_store import Message
+from post_validator import MAX_REGENERATIONS, theme_hashtag, validate_post
+
+# --- Streamlit に依存しない論争ロジック ---
+# app.py (画面) と generate_packs.py (オフライン一括生成) の両方から使う。
+
+# --- 生成モデル設定 ---
+MODEL_NAME = "gpt-3.5-turbo"
+TEMPERATURE = 1.0
+STOP_WORDS = ["不合格", "理解しました", "申し訳", "システムエラー"]
+META_PREFIXES = ["不合格です", "理解しました", "申し訳ありません", "システム上のエラー", "回答は無効", "この投稿は"]
+META_PATTERN = re.compile(r'^(' + '|'.join(META_PREFIXES) + r').*?\n?')
+
+# 教室のプロジェクター前提の読み上げ速度 (文字/秒) と待ち時間の上下限
+READING_CHARS_PER_SEC = 8
+MIN_READING_PAUSE = 1.5
+MAX_READING_PAUSE = 8.0
+
+# --- 論争テーマ ---
+FREE_THEME = "自由テーマ (下の入力欄を使用)"
+THEME_OPTIONS = [
+    "全国三部会の停止 (1614年・身分制の対立)",
+    "フロンドの乱 (1648年・貴族と高等法院の反乱)",
+    "ナントの勅令廃止 (1685年・宗教弾圧と亡命)",
+    "宗教改革 (免罪符について)", 
+    FREE_THEME,
+]
+PRESET_THEMES = [t for t in THEME_OPTIONS if t != FREE_THEME]
+
+# --- データ読み込み (詳細属性・リスト/辞書完全対応) ---
+def load_characters(path='characters.json'):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return {item.get('id', item.get('image', f'char_{i}').split('.')[0]): item for i, item in enumerate(data)}
+    return data
+
+# --- キャラクター役職の判定 (IDの部分一致はここでだけ行う) ---
+ROLE_AVATARS = {
+    "citizen": "👤",
+    "louis": "👑",
+    "leo": "🇻🇦",
+    "luther": "✝️",
+    "minister": "📜",
+    "german_noble": "⚔️",
+    "french_noble": "⚔️",
+    "huguenot": "🔨",
+    "other": "🧑‍⚖️",
+}
+
+def classify_role(char_key):
+    """キャラクターIDから役職 (louis/minister/noble/…) を判定する"""
+    key = char_key.lower()
+    if char_key == "citizen": return "citizen"
+    if 'louis' in key: return "louis"
+    if 'minister' in key: return "minister"
+    if 'german' in key: return "german_noble"
+    if 'french' in key or 'fronde' in key or 'noble' in key: return "french_noble"
+    if 'huguenot' in key: return "huguenot"
+    if 'luther' in key: return "luther"
+    if 'leo' in key: return "leo"
+    return "other"
+
+# --- テーマ×役職のルール表 (themes.json) ---
+# 指示文・表示名・発言候補・発言順をテーマごとに1か所で定義し、登録簿の構築時に
+# (テーマID, 役職) をキーにした辞書へ1回だけ展開する。テーマを増やすときは themes.json だけを編集する。
+DEFAULT_THEME_ID = "free"
+
+def load_theme_rules(path='themes.json'):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def compile_theme_rules(config, by_role, char_ids):
+    """themes.json を (テーマID, 役職) → 指示文・表示名 と テーマID → 発言候補・発言順 の辞書に展開する"""
+    defaults = config["defaults"]
+    themes = config["themes"] + [{"id": DEFAULT_THEME_ID}]
+    rules = {}
+    policies = {}
+    for theme in themes:
+        theme_id = theme["id"]
+        names = {**defaults["names"], **theme.get("names", {})}
+        instructions = {**defaults["instructions"], **theme.get("instructions", {})}
+        for role in ROLE_AVATARS:
+            rules[(theme_id, role)] = {"name": names.get(role), "instruction": instructions[role]}
+
+        # 候補の役職が登録簿に揃っていなければ、全キャラクターから選ぶ
+        required = theme.get("candidates_require", defaults["candidates_require"] if "candidates" not in theme else [])
+        if all(by_role.get(r) for r in required):
+            candidates = [by_role[r] for r in theme.get("candidates", defaults["candidates"]) if by_role.get(r)]
+        else:
+            candidates = list(char_ids)
+        policies[theme_id] = {
+            "candidates": candidates,
+            "turn_order": theme.get("turn_order", defaults["turn_order"]),
+            "sequence": [by_role[r] for r in theme.get("sequence", []) if by_role.get(r)],
+            "citizen_rate": theme.get("citizen_rate", defaults["citizen_rate"]),
+            "citizen_every": theme.get("citizen_every", defaults["citizen_every"]),
+        }
+    matchers = [(theme["match"], theme["id"]) for theme in config["themes"]]
+    return {
+        "matchers": matchers,
+        "rules": rules,
+        "policies": policies,
+        # プリセットのテーマだけ先に引いておく (自由テーマは入力のたびに増えるので覚えない)
+        "theme_ids": {theme: match_theme_id(matchers, theme) for theme in PRESET_THEMES},
+    }
+
+def match_theme_id(matchers, current_theme):
+    return next((tid for match, tid in matchers if match in current_theme), DEFAULT_THEME_ID)
+
+def theme_id_for(registry, current_theme):
+    """テーマ文字列からテーマIDを引く (プリセットは引いておいた表から、自由テーマはその都度部分一致で)"""
+    table = registry["theme_rules"]
+    theme_id = table["theme_ids"].get(current_theme)
+    return theme_id if theme_id is not None else match_theme_id(table["matchers"], current_theme)
+
+# --- キャラクター登録簿 ---
+def build_character_registry(characters_path='characters.json', static_dir='static', themes_path='themes.json'):
+    """キャラクターごとに役職・解決済みアバターをまとめ、テーマ×役職のルール表を添える"""
+    data = load_characters(characters_path)
+    # static/ の中身を小文字名で索引化し、大文字小文字違いのファイル名もここで1回だけ解決する
+    static_index = {f.lower(): f for f in os.listdir(static_dir)} if os.path.isdir(static_dir) else {}
+
+    entries = {}
+    by_role = {}
+    for char_key, char in data.items():
+        role = classify_role(char_key)
+        image_name = char.get('image')
+        found = static_index.get(image_name.lower()) if image_name else None
+        entries[char_key] = {
+            "data": char,
+            "role": role,
+            "avatar": f"{static_dir}/{found}" if found else ROLE_AVATARS[role],
+        }
+        by_role.setdefault(role, char_key)
+
+    return {
+        "characters": data,
+        "entries": entries,
+        "by_role": by_role,
+        "avatar_paths": {e["avatar"] for e in entries.values() if e["avatar"].startswith(f"{static_dir}/")},
+        "theme_rules": compile_theme_rules(load_theme_rules(themes_path), by_role, data.keys()),
+    }
+
+def char_role(registry, char_key):
+    """登録簿から役職を引く (未登録IDはその場で判定)"""
+    entry = registry["entries"].get(char_key)
+    return entry["role"] if entry else classify_role(char_key)
+
+def resolve_rule(registry, current_theme, char_key):
+    """ルール表から (表示名, 指示文) を引く"""
+    role = char_role(registry, char_key)
+    rule = registry["theme_rules"]["rules"][(theme_id_for(registry, current_theme), role)]
+    char = registry["characters"].get(char_key, {})
+    name = rule["name"] or char.get('name')
+    instruction = rule["instruction"]
+    if role == "other":
+        instruction = instruction.format(name=char.get('name'), persona=char.get('persona', char.get('description', '')))
+    return name, instruction
+
+def get_display_name(registry, char_key, current_theme):
+    """テーマに応じた表示名 (王・宰相はテーマで名前が変わる)"""
+    return resolve_rule(registry, current_theme, char_key)[0]
+
+# --- 投稿の整形 ---
+def clean_post(text):
+    """stopワード以降を切り捨て、冒頭のメタ発言を除去した投稿本文を返す"""
+    for word in STOP_WORDS:
+        idx = text.find(word)
+        if idx != -1:
+            text = text[:idx]
+    return META_PATTERN.sub('', text).strip()
+
+def preview_post(text):
+    """ストリーミング途中の表示用テキスト (メタ発言やstopワードになりうる末尾は保留する)"""
+    head = text.lstrip()
+    if any(p.startswith(head) for p in META_PREFIXES + STOP_WORDS):
+        return ""
+    for k in range(min(len(text), max(len(w) for w in STOP_WORDS) - 1), 0, -1):
+        if any(w.startswith(text[-k:]) for w in STOP_WORDS):
+            text = text[:-k]
+            break
+    return clean_post(text)
+
+def format_content(text):
+    formatted_text = re.sub(r'(#\w+)', r'<span class="hashtag">\1</span>', text)
+    return formatted_text.replace('\n', '<br>')
+
+def make_message(role, name, content, avatar):
+    """タイムラインに追加する投稿 (ハッシュタグ整形済みのHTMLも追加時に1回だけ作っておく)"""
+    return Message(role, name, content, avatar, format_content(content))
+
+def make_post_check(registry, current_theme, char_key):
+    """発言者とテーマに合わせた投稿の検証関数 (投稿 → (直した投稿, 問題のリスト)。作り直しが必要なら投稿は空文字)"""
+    role = char_role(registry, char_key)
+    hashtag = theme_hashtag(current_theme)
+    return lambda text: validate_post(text, role, hashtag)
+
+def reading_pause(text, shown_for=0.0):
+    """投稿を読み切るための待ち時間 (ストリーミング中に表示されていた時間は差し引く)"""
+    need = min(MAX_READING_PAUSE, max(MIN_READING_PAUSE, len(text) / READING_CHARS_PER_SEC))
+    return max(MIN_READING_PAUSE, need - shown_for)
+
+# --- 発言者選択 & プロンプト組み立て (ルール表から引く) ---
+def pick_speaker(registry, current_theme, roles, round_no, rng=random):
+    """これまでの発言者の並びと進行ラウンドから、次の発言者を選ぶ"""
+    policy = registry["theme_rules"]["policies"][theme_id_for(registry, current_theme)]
+    last_role = roles[-1] if roles else "none"
+
+    if round_no > 1 and last_role != "citizen" and (rng.random() < policy["citizen_rate"] or round_no % policy["citizen_every"] == 0):
+        return "citizen"
+
+    # 交互制 (ナントの勅令廃止: ユグノーの宣言 → ルイ14世の嘆き)
+    sequence = policy["sequence"]
+    if policy["turn_order"] == "alternate" and sequence:
+        last_main_role = next((r for r in reversed(roles) if r in sequence), None)
+        if last_main_role is None:
+            return sequence[0]
+        return sequence[(sequence.index(last_main_role) + 1) % len(sequence)]
+
+    candidates = policy["candidates"]
+    recent_roles = roles[-2:]
+    remaining = [c for c in candidates if c not in recent_roles]
+    return rng.choice(remaining) if remaining else rng.choice(candidates)
+
+def build_turn(registry, current_theme, current_char_id):
+    """自動論争の1投稿分について、発言者の表示名とシステムプロンプトを組み立てる"""
+    name, role_inst = resolve_rule(registry, current_theme, current_char_id)
+    # 名前決定 (AI自動投稿時)
+    if current_char_id == "citizen":
+        name = "市民のつぶやき"
+
+    # stopパラメータを4つに修正済み
+    system_prompt = (
+        f"### 命令: あなたは今から【{role_inst}】そのものとして振る舞い、テーマ『{current_theme}』についてSNS投稿を行います。\n"
+        "### 制約:\n"
+        "1. 140文字以内の【投稿内容のみ】を出力せよ。\n"
+        "2. 前置き、解説、相槌（『理解しました』『ありがとうございます』『不合格です』等）、AIとしてのメタ発言は一切禁止する。\n"
+        "3. なりきりを貫き、相手の意見に安易に同調しないこと。\n"
+        "4. ハッシュタグ（#）を含めよ。"
+    )
+    return name, system_prompt
+
+def build_manual_prompt(registry, current_theme, selected_id):
+    """個別投稿 (AIが自動作成) 用のプロンプトを組み立てる (指示文は自動論争と同じルール表から引く)"""
+    role_inst = resolve_rule(registry, current_theme, selected_id)[1]
+
+    # メタ発言禁止
+    prompt = (
+        f"役割: {role_inst}\n"
+        f"タスク: テーマ『{current_theme}』について、140文字以内のSNS投稿を作成せよ。\n"
+        "絶対ルール: 挨拶・解説・メタ発言（『不合格です』等）は一切禁止。投稿本文のみを直接出力せよ。ハッシュタグ（#）必須。"
+    )
+    return prompt
+
+def build_context(system_prompt, history, builder=None, report=None):
+    """システムプロンプトに、古い投稿の要約と直近の投稿を予算内で添えた messages を作る (report は ContextBuilder.build と同じ)"""
+    return (builder or ContextBuilder()).build(system_prompt, history, report)
+
+# --- 生成 ---
+def complete_post(client, messages, max_tokens, cache=None, variety=1, stats=None, check=None):
+    """ストリーミングなしで生成し、整形済みの投稿本文を返す (st.* を呼ばないのでワーカースレッドからも使える)
+
+    stats に辞書を渡すと、API 時間・整形時間・トークン数・キャッシュ利用の有無を書き込む。
+    check (make_post_check) を渡すと整形後に検証し、直した問題・作り直しが必要な問題を stats["rejections"] に書き込む。
+    """
+    stats = {} if stats is None else stats
+    stats["cache_hit"] = False
+    stats["rejections"] = []
+    cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE, max_tokens) if cache else None
+    if cache:
+        cached = cache.get(cache_key, variety)
+        if cached:
+            stats["cache_hit"] = True
+            return cached
+    started = time.perf_counter()
+    response = client.chat.completions.create(model=MODEL_NAME, messages=messages, max_tokens=max_tokens, temperature=TEMPERATURE, stop=STOP_WORDS)
+    stats["api"] = time.perf_counter() - started
+    raw = response.choices[0].message.content or ""
+    started = time.perf_counter()
+    clean_text = clean_post(raw)
+    if check:
+        clean_text, stats["rejections"] = check(clean_text)
+    stats["clean"] = time.perf_counter() - started
+    # usage が返らないクライアントでは文字数からの見積もりで代用する
+    usage = getattr(response, "usage", None)
+    stats["prompt_tokens"] = usage.prompt_tokens if usage else message_tokens(messages)
+    stats["completion_tokens"] = usage.completion_tokens if usage else estimate_tokens(raw)
+    if cache and clean_text:
+        cache.put(cache_key, clean_text, variety)
+    return clean_text
+
+def run_debate(client, registry, current_theme, rounds, rng=random, max_empty_retries=MAX_REGENERATIONS):
+    """Streamlit なしで1つの論争を最後まで生成し、投稿 (role/name/content) のリストを返す"""
+    posts = []
+    empty_count = 0
+    builder = ContextBuilder()
+    while len(posts) < rounds:
+        char_id = pick_speaker(registry, current_theme, [p["role"] for p in posts], len(posts), rng)
+        name, system_prompt = build_turn(registry, current_theme, char_id)
+        check = make_post_check(registry, current_theme, char_id)
+        content = complete_post(client, build_context(system_prompt, posts, builder), 150, check=check)
+        if not content:
+            # 画面版と同じく、検証で直せなかった投稿は作り直す (ただし無限に払い続けないよう連続回数に上限を設ける)
+            empty_count += 1
+            if empty_count > max_empty_retries:
+                break
+            continue
+        empty_count = 0
+        posts.append({"role": char_id, "name": name, "content": content})
+    return posts
+
+# --- 論争パック (事前生成した論争を1行1論争の JSONL で保存する。.gz なら gzip 圧縮) ---
+def open_pack(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def write_pack_entry(f, debate):
+    f.write(json.dumps(debate, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+def load_pack(path):
+    """論争パックを読み込み、論争 (theme/posts/…) のリストを返す"""
+    with open_pack(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
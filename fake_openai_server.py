@@ -0,0 +1,110 @@
+"""ベンチマーク用のローカル OpenAI 代役サーバ (/v1/chat/completions だけを真似る)
+
+応答までの待ち時間・生成速度 (トークン/秒)・エラー率を指定でき、stream=True にも応える。
+
+    python fake_openai_server.py --port 8765 --latency 0.3 --token-rate 40 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from context_builder import estimate_tokens, message_tokens
+from mock_openai import mock_post
+
+# 1チャンクあたりの文字数 (実際の API もおおよそ数文字ずつ届く)
+CHUNK_CHARS = 4
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+            failed = self.server.rng.random() < config["error_rate"]
+            text = mock_post(body.get("messages") or [], self.server.rng)
+        time.sleep(config["latency"])
+        if failed:
+            # レート制限とサーバーエラーを半々で返す (クライアント側の再試行を通す)
+            with self.server.lock:
+                self.server.stats["errors"] += 1
+            status = 429 if self.server.rng.random() < 0.5 else 500
+            return self._send_json(status, {"error": {"message": "fake error", "type": "fake"}}, {"Retry-After": "0"})
+
+        prompt_tokens = message_tokens(body.get("messages") or [])
+        completion_tokens = estimate_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        if body.get("stream"):
+            return self._send_stream(text, usage, body.get("stream_options", {}).get("include_usage"))
+        # ストリーミングなしでも、生成速度ぶんの時間をかけて返す
+        time.sleep(completion_tokens / config["token_rate"])
+        self._send_json(200, {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, text, usage, include_usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        base = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake"}
+        for i in range(0, len(text), CHUNK_CHARS):
+            piece = text[i:i + CHUNK_CHARS]
+            time.sleep(estimate_tokens(piece) / self.server.config["token_rate"])
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if include_usage:
+            self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+def start_server(host="127.0.0.1", port=0, latency=0.3, token_rate=40.0, error_rate=0.0, seed=None):
+    """代役サーバをバックグラウンドのスレッドで起動し、(server, base_url) を返す (port=0 なら空きポート)"""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {"latency": latency, "token_rate": token_rate, "error_rate": error_rate}
+    server.stats = {"requests": 0, "errors": 0}
+    server.lock = threading.Lock()
+    server.rng = random.Random(seed)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカルの OpenAI 代役サーバを起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="応答を返し始めるまでの秒数")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="生成速度 (トークン/秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429/500 を返す割合 (0〜1)")
+    args = parser.parse_args()
+    server, base_url = start_server(args.host, args.port, args.latency, args.token_rate, args.error_rate)
+    print(f"OPENAI_BASE_URL={base_url} で待ち受け中 (Ctrl+C で終了)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,93 @@
+"""論争パックのオフライン一括生成
+
+授業前に各テーマの論争を丸ごと生成して JSONL (.gz 可) に保存しておき、
+授業中は app.py の「論争パック再生」で API を呼ばずに再生する。
+
+    python generate_packs.py --debates 5 --rounds 10 --out packs/lesson.jsonl.gz
+    python generate_packs.py --mock --debates 2   # ネットワークなしで動作確認
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from debate_core import (
+    MODEL_NAME, PRESET_THEMES, build_character_registry, run_debate, write_pack_entry, open_pack,
+)
+from mock_openai import MockOpenAI
+
+def load_api_key():
+    """環境変数、なければ .streamlit/secrets.toml から API キーを読む"""
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    secrets_path = os.path.join(".streamlit", "secrets.toml")
+    if os.path.exists(secrets_path):
+        import tomllib
+        with open(secrets_path, "rb") as f:
+            return tomllib.load(f).get("OPENAI_API_KEY")
+    return None
+
+def generate(client, registry, themes, debates_per_theme, rounds, workers, out_path, seed=None):
+    """テーマ×本数の論争を最大 workers 本ずつ並列に生成し、できた順にパックへ書き出す"""
+    base_rng = random.Random(seed)
+    jobs = [(theme, base_rng.random()) for theme in themes for _ in range(debates_per_theme)]
+    written = 0
+    if os.path.dirname(out_path):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    def work(theme, job_seed):
+        started = time.time()
+        posts = run_debate(client, registry, theme, rounds, random.Random(job_seed))
+        return {"theme": theme, "model": MODEL_NAME, "rounds": rounds, "created": int(started),
+                "elapsed": round(time.time() - started, 2), "posts": posts}
+
+    with open_pack(out_path, "w") as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(work, theme, job_seed) for theme, job_seed in jobs]
+        for future in as_completed(futures):
+            try:
+                debate = future.result()
+            except Exception as e:
+                print(f"生成失敗: {e}", file=sys.stderr)
+                continue
+            if len(debate["posts"]) < rounds:
+                print(f"投稿数不足のため除外: {debate['theme']} ({len(debate['posts'])}/{rounds})", file=sys.stderr)
+                continue
+            write_pack_entry(f, debate)
+            written += 1
+            print(f"[{written}/{len(jobs)}] {debate['theme']} ({debate['elapsed']}秒)")
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="論争パックをオフラインで一括生成する")
+    parser.add_argument("--themes", nargs="*", default=PRESET_THEMES, help="生成するテーマ (省略時はプリセット全部)")
+    parser.add_argument("--debates", type=int, default=3, help="テーマごとの論争数")
+    parser.add_argument("--rounds", type=int, default=10, help="1論争あたりの投稿数 (1〜50)")
+    parser.add_argument("--workers", type=int, default=4, help="同時に生成する論争の数")
+    parser.add_argument("--out", default=os.path.join("packs", "debates.jsonl.gz"), help="出力先 (.jsonl または .jsonl.gz)")
+    parser.add_argument("--mock", action="store_true", help="API を呼ばずに代役クライアントで生成する")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.rounds <= 50:
+        parser.error("--rounds は 1〜50 で指定してください")
+
+    if args.mock:
+        client = MockOpenAI(seed=args.seed)
+    else:
+        api_key = load_api_key()
+        if not api_key:
+            parser.error("OPENAI_API_KEY が見つかりません (環境変数か .streamlit/secrets.toml に設定してください)")
+        from openai import OpenAI
+        from llm_client import ResilientClient
+        # 一括生成でも 429/5xx はバックオフして再試行する
+        client = ResilientClient(OpenAI(api_key=api_key, max_retries=0), max_concurrency=args.workers)
+
+    registry = build_character_registry()
+    written = generate(client, registry, args.themes, args.debates, args.rounds, args.workers, args.out, args.seed)
+    print(f"{written} 件の論争を {args.out} に書き出しました。")
+    return 0 if written else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
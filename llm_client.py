@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from openai import APIConnectionError
+
+# --- OpenAI 呼び出しの共通ラッパー ---
+# プロセス内で1つだけ作り、全セッション・先読みスレッドで共有する。
+# 同時実行数の上限、429/5xx のジッター付き指数バックオフ、リクエストごとのタイムアウト、
+# 障害が続いたときに API を呼ばずに即座に失敗させるサーキットブレーカーを受け持つ。
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """障害が続いたため、回路が閉じるまで API を呼ばない"""
+
+def is_retryable(error):
+    """再試行して意味のある失敗か (レート制限・サーバーエラー・タイムアウト・接続断)"""
+    if isinstance(error, (APIConnectionError, TimeoutError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+def retry_after_seconds(error):
+    """429 などで返る Retry-After ヘッダーの秒数 (なければ None)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """トークンバケット: 平均 rate 件/秒、瞬間的には burst 件まで通す (待つ順番は呼び出し順)"""
+
+    def __init__(self, rate, burst=None, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._sleep = sleep
+
+    def acquire(self):
+        """1件分の枠を確保し、待った秒数を返す (枠は先に予約するので、後から来た呼び出しが追い越さない)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+class ResilientClient:
+    """OpenAI クライアントと同じ chat.completions.create(...) で呼べる、再試行・流量制御付きのラッパー"""
+
+    def __init__(self, client, max_concurrency=8, max_retries=4, base_delay=0.5, max_delay=10.0,
+                 timeout=20.0, failure_threshold=5, reset_after=30.0, rate_limiter=None, sleep=time.sleep):
+        self._client = client
+        self.rate_limiter = rate_limiter
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._sleep = sleep
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "short_circuits": 0, "rate_limited": 0}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    # --- サーキットブレーカー ---
+    def _before_call(self):
+        """回路が開いていれば即座に失敗させる。開いてから reset_after 秒経ったら1件だけ試しに通す"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_after or self._trial_running:
+                self.stats["short_circuits"] += 1
+                raise CircuitOpenError("OpenAI API への接続が不安定なため、一時的に呼び出しを止めています")
+            self._trial_running = True
+
+    def _record(self, ok, outage=True):
+        """呼び出しの結果を記録する (outage=False の失敗は回路を開く判断に数えない)"""
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+            self.stats["failures"] += 1
+            if not outage:
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.time()
+
+    # --- 呼び出し本体 ---
+    def _backoff(self, attempt, error):
+        """ジッター付き指数バックオフ (Retry-After があればそれ以上待つ)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            delay = max(delay, min(hinted, self.max_delay))
+        return delay
+
+    def _create(self, **kwargs):
+        self._before_call()
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            # 全セッション共有の流量制限 (再試行も1件として数える)
+            if self.rate_limiter and self.rate_limiter.acquire():
+                with self._lock:
+                    self.stats["rate_limited"] += 1
+            # 同時実行数の枠はリクエスト中だけ確保し、バックオフ中は他のセッションに譲る
+            # (stream=True の場合は応答ヘッダーを受け取るまでを数える)
+            with self._slots:
+                with self._lock:
+                    self.stats["calls"] += 1
+                try:
+                    result = self._client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    retryable = is_retryable(e)
+                    if not retryable or attempt == self.max_retries:
+                        # 400/401 などは API 側の障害ではないので、429・5xx・タイムアウトだけを数える
+                        self._record(ok=False, outage=retryable)
+                        raise
+                    delay = self._backoff(attempt, e)
+                else:
+                    self._record(ok=True)
+                    return result
+            with self._lock:
+                self.stats["retries"] += 1
+            self._sleep(delay)
@@ -0,0 +1,235 @@
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import deque
+
+# --- タイムラインの投稿ログ (メモリには直近だけ、全件はディスクに追記) ---
+# 投稿は __slots__ の軽いレコードにし、発言者ID・表示名・アバターのパスは intern して全投稿で共有する。
+# メモリに持つのは直近 tail 件だけで、全件はセッションIDごとの JSONL セグメントに追記していく。
+# ブラウザが切断されても、同じセッションIDで開き直せば (前日の論争でも) そのまま読み込める。
+# 1つのログに書き込めるのは1つのセッションだけで、ロックファイルに書き手を記録しておく。
+
+DEFAULT_SESSIONS_DIR = os.path.join(".cache", "sessions")
+MESSAGE_TAIL = 200
+SEGMENT_SIZE = 500
+LOCK_FILE = "writer.lock"
+META_FILE = "meta.json"
+_lock = threading.Lock()
+
+class SessionInUseError(Exception):
+    """ほかのセッションが書き込み中のログを開こうとした"""
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Message:
+    """タイムラインの1投稿 (既存コードの msg["role"] / msg.get("html") もそのまま使える)"""
+    __slots__ = ("role", "name", "content", "avatar", "html", "ts")
+
+    def __init__(self, role, name, content, avatar, html=None, ts=None):
+        self.role = _intern(role)
+        self.name = _intern(name)
+        self.content = content
+        self.avatar = _intern(avatar)
+        self.html = html
+        self.ts = ts if ts is not None else time.time()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_record(self):
+        """ディスクに書く形 (HTML は読み込み時に作り直す)"""
+        return {"role": self.role, "name": self.name, "content": self.content, "avatar": self.avatar, "ts": round(self.ts, 3)}
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.name!r}, {self.content!r})"
+
+def new_session_id():
+    """日時 + 乱数のセッションID (一覧で並べたときに新しい順が分かるように)"""
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+
+def is_valid_session_id(session_id):
+    return bool(session_id) and all(ch.isalnum() or ch == "-" for ch in session_id)
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # Windows では確かめられないので、ほかのプロセスのロックは残骸とみなす
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+class MessageLog:
+    """直近 tail 件だけをメモリに持ち、全件をセグメント分けした JSONL に追記する投稿ログ
+
+    len() やスライスはメモリ上の直近分に対して働く。これまでの総件数は total、
+    直近分より古い投稿は recent(n) でディスクから読み出す。
+    owner はロックに記録する書き手の名前で、同じプロセスの別の書き手が開いているときは
+    is_live(owner) が偽を返した場合だけ (切断済みのセッションなど) 引き継ぐ。
+    ログと一緒に残したい小さな状態は meta に入れて save_meta() で保存する。
+    """
+
+    def __init__(self, session_id=None, root=DEFAULT_SESSIONS_DIR, tail=MESSAGE_TAIL, factory=Message,
+                 owner=None, is_live=None):
+        self.session_id = session_id or new_session_id()
+        if not is_valid_session_id(self.session_id):
+            raise ValueError(f"不正なセッションID: {self.session_id}")
+        self.root = os.path.join(root, self.session_id)
+        self.factory = factory
+        self.owner = owner or secrets.token_hex(8)
+        self.is_live = is_live or (lambda owner: True)
+        self._tail = deque(maxlen=tail)
+        self.total = 0
+        self._segment = 0        # 追記先のセグメント番号
+        self._segment_count = 0  # 追記先のセグメントにある件数
+        self._acquire()
+        self.meta = self._read_meta()
+        self._load_tail()
+
+    # --- 書き手のロック ---
+    def _lock_path(self):
+        return os.path.join(self.root, LOCK_FILE)
+
+    def _holder(self):
+        try:
+            with open(self._lock_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _acquire(self):
+        """ほかの生きている書き手がいなければロックを取る (いれば SessionInUseError)"""
+        with _lock:
+            holder = self._holder()
+            if holder and holder.get("owner") != self.owner:
+                if holder.get("pid") == os.getpid():
+                    alive = self.is_live(holder.get("owner"))
+                else:
+                    alive = _pid_alive(holder.get("pid", 0))
+                if alive:
+                    raise SessionInUseError(f"セッション {self.session_id} はほかの画面で使われています")
+            os.makedirs(self.root, exist_ok=True)
+            with open(self._lock_path(), "w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "owner": self.owner}, f)
+
+    def close(self):
+        """ロックを手放す (ログはディスクに残る)"""
+        with _lock:
+            if self._owns_lock():
+                os.remove(self._lock_path())
+
+    def _owns_lock(self):
+        holder = self._holder()
+        return bool(holder) and holder.get("pid") == os.getpid() and holder.get("owner") == self.owner
+
+    # --- ログと一緒に残す状態 ---
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.root, META_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self):
+        with open(os.path.join(self.root, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+
+    # --- ディスク上のセグメント ---
+    def _segment_path(self, index):
+        return os.path.join(self.root, f"{index:06d}.jsonl")
+
+    def _segments(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(f.split(".")[0]) for f in os.listdir(self.root) if f.endswith(".jsonl"))
+
+    def _read_segment(self, index):
+        with open(self._segment_path(index), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _count_segment(self, index):
+        with open(self._segment_path(index), encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip())
+
+    def _from_record(self, record):
+        message = self.factory(record["role"], record["name"], record["content"], record["avatar"])
+        message.ts = record.get("ts", message.ts)
+        return message
+
+    def _read_last(self, n):
+        """ディスクから新しい順に n 件までを読み、古い順のリストで返す"""
+        records = []
+        for index in reversed(self._segments()):
+            records = self._read_segment(index) + records
+            if len(records) >= n:
+                break
+        return records[-n:] if n else []
+
+    def _load_tail(self):
+        segments = self._segments()
+        if not segments:
+            return
+        # 古い版や途中で止まった書き込みでは SEGMENT_SIZE 件ちょうどとは限らないので、実際の行数を数える
+        counts = [self._count_segment(index) for index in segments]
+        self.total = sum(counts)
+        self._segment, self._segment_count = segments[-1], counts[-1]
+        self._tail.extend(self._from_record(r) for r in self._read_last(self._tail.maxlen))
+
+    # --- リストとしての振る舞い (直近分) ---
+    def append(self, message):
+        with _lock:
+            # 切断したセッションの書き込みが、ログを引き継いだセッションの投稿に混ざらないようにする
+            if not self._owns_lock():
+                raise SessionInUseError(f"セッション {self.session_id} はほかの画面に引き継がれました")
+            if self._segment_count >= SEGMENT_SIZE:
+                self._segment, self._segment_count = self._segment + 1, 0
+            with open(self._segment_path(self._segment), "a", encoding="utf-8") as f:
+                f.write(json.dumps(message.to_record(), ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._tail.append(message)
+        self._segment_count += 1
+        self.total += 1
+
+    def __len__(self):
+        return len(self._tail)
+
+    def __iter__(self):
+        return iter(self._tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._tail)[index]
+        return self._tail[index]
+
+    def recent(self, n):
+        """最新 n 件を古い順に返す (メモリ上の直近分で足りなければディスクから読む)"""
+        if len(self._tail) >= min(n, self.total):
+            return list(self._tail)[-n:] if n else []
+        return [self._from_record(r) for r in self._read_last(min(n, self.total))]
+
+def list_sessions(root=DEFAULT_SESSIONS_DIR):
+    """保存済みのセッション (新しい順) と、それぞれの最終更新時刻"""
+    if not os.path.isdir(root):
+        return []
+    sessions = []
+    for session_id in os.listdir(root):
+        path = os.path.join(root, session_id)
+        if not (os.path.isdir(path) and is_valid_session_id(session_id)):
+            continue
+        # 開いただけで投稿のないセッション (ロックファイルだけ) は並べない
+        segments = [f for f in os.listdir(path) if f.endswith(".jsonl")]
+        if segments:
+            sessions.append({"id": session_id, "updated": max(os.path.getmtime(os.path.join(path, f)) for f in segments)})
+    return sorted(sessions, key=lambda s: s["updated"], reverse=True)
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# --- 生成1回ごとの計測 (所要時間・トークン数・キャッシュ・空投稿・投稿検証) ---
+# プロセス内で1つだけ作り、全セッション・先読みスレッドから記録する。
+# サイドバーには p50/p95 を出し、JSONL / Prometheus テキスト形式で書き出してデプロイ間の比較に使う。
+
+# 1ターンの内訳 (表示順)
+STAGES = ["select", "prompt", "api", "first_token", "prefetch_wait", "clean", "render", "pause", "turn"]
+STAGE_LABELS = {
+    "select": "発言者選択",
+    "prompt": "文脈組み立て",
+    "api": "API 生成",
+    "first_token": "最初の文字まで",
+    "prefetch_wait": "先読み待ち",
+    "clean": "整形",
+    "render": "描画",
+    "pause": "読了待ち",
+    "turn": "1投稿あたり",
+}
+COUNTERS = ["turns", "prompt_tokens", "completion_tokens", "cache_hits", "cache_misses", "empty_outputs", "fallbacks", "errors"]
+
+def percentile(samples, q):
+    """最近傍法のパーセンタイル (サンプルがなければ None)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Metrics:
+    """段階ごとの所要時間 (直近 window 件) とカウンターを持つ"""
+
+    def __init__(self, window=500, log_path=None):
+        self._lock = threading.Lock()
+        self._samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self._sums = dict.fromkeys(STAGES, 0.0)
+        self._counts = dict.fromkeys(STAGES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # 投稿検証で見つかった問題 (理由, "repaired" / "rejected") → 件数
+        self.rejections = {}
+        self.turns = deque(maxlen=window)
+        self.log_path = log_path
+        self.started = time.time()
+
+    # --- 記録 ---
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+
+    @contextmanager
+    def timer(self, stage, record=None):
+        """with の中の所要時間を stage に記録する (record を渡すとターンの記録にも書き込む)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(stage, elapsed)
+            if record is not None:
+                record[stage] = round(elapsed, 4)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record_generation(self, stats):
+        """complete_post / stream_post が返した生成の内訳 (トークン数・キャッシュ・整形時間・検証結果) を記録する"""
+        self.count("cache_hits" if stats.get("cache_hit") else "cache_misses")
+        self.count("prompt_tokens", stats.get("prompt_tokens", 0))
+        self.count("completion_tokens", stats.get("completion_tokens", 0))
+        with self._lock:
+            for key in stats.get("rejections", []):
+                self.rejections[key] = self.rejections.get(key, 0) + 1
+        for stage in ("api", "first_token", "clean"):
+            if stats.get(stage) is not None:
+                self.observe(stage, stats[stage])
+
+    def record_turn(self, record):
+        """1ターン分の記録を残す (log_path があれば JSONL に追記する)"""
+        record = {"ts": round(time.time(), 3), **record}
+        with self._lock:
+            self.turns.append(record)
+            # 空で作り直しになった試行は empty_outputs で数え、投稿数には含めない
+            if not record.get("empty"):
+                self.counters["turns"] += 1
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # --- 集計・書き出し ---
+    def summary(self):
+        """段階ごとの件数・p50・p95 (秒)"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        return [
+            {"stage": stage, "count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            for stage, values in samples.items() if values
+        ]
+
+    def to_jsonl(self):
+        """直近のターンの記録を1行1ターンの JSONL で返す"""
+        with self._lock:
+            return "".join(json.dumps(t, ensure_ascii=False) + "\n" for t in self.turns)
+
+    def to_prometheus(self, extra=None, prefix="moshitsui"):
+        """Prometheus のテキスト形式で返す (extra には API クライアントの再試行数などを渡す)"""
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        with self._lock:
+            for stage in STAGES:
+                values = list(self._samples[stage])
+                for q in (0.5, 0.95):
+                    value = percentile(values, q)
+                    if value is not None:
+                        lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {self._sums[stage]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {self._counts[stage]}')
+            counters = dict(self.counters)
+            rejections = dict(self.rejections)
+        lines.append(f"# TYPE {prefix}_post_rejections_total counter")
+        for (reason, action), value in sorted(rejections.items()):
+            lines.append(f'{prefix}_post_rejections_total{{reason="{reason}",action="{action}"}} {value}')
+        for name, value in {**counters, **(extra or {})}.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
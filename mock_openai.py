@@ -0,0 +1,54 @@
+"""API を呼ばない OpenAI の代役 (テスト・動作確認・ベンチマーク用)
+
+generate_packs.py --mock、rooms.py のシミュレーション、fake_openai_server.py、tests/ から使う。
+"""
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+MOCK_LINES = [
+    "この横暴、断じて許さぬ！",
+    "我らの声を聞け。歴史は必ず我らを正しいと認めるだろう。",
+    "黙っていられるか。今こそ立ち上がる時だ！",
+    "神はすべてを見ておられる。",
+    "特権とは責任のことだと、なぜ誰も分からぬのか。",
+]
+
+def mock_post(messages, rng=random):
+    """システムプロンプトの テーマ『…』 からハッシュタグを作り、定型文に添えた投稿を返す"""
+    system = messages[0]["content"] if messages else ""
+    theme = system.split("テーマ『", 1)[-1].split("』", 1)[0] if "テーマ『" in system else "論争"
+    tag = "".join(ch for ch in theme.split(" ")[0] if ch.isalnum()) or "論争"
+    return f"{rng.choice(MOCK_LINES)} #{tag}"
+
+class MockOpenAI:
+    """OpenAI クライアントの chat.completions.create だけを真似る代役"""
+
+    def __init__(self, latency=0.0, seed=None):
+        self.latency = latency
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _compose(self, messages):
+        with self._lock:
+            self.calls += 1
+            return mock_post(messages, self._rng)
+
+    def _create(self, model=None, messages=None, max_tokens=None, temperature=None, stop=None, stream=False, **kwargs):
+        text = self._compose(messages or [])
+        if self.latency:
+            time.sleep(self.latency)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages or []), completion_tokens=len(text))
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if stream:
+            return (
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 4]))])
+                for i in range(0, len(text), 4)
+            )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason="stop")],
+            usage=usage,
+        )
@@ -0,0 +1,130 @@
+import re
+
+# --- 生成された投稿の検証 (140文字・ハッシュタグ必須・メタ発言・なりすまし) ---
+# 1本にまとめた正規表現で投稿を1回だけ走査し、直せるもの (長すぎる・ハッシュタグがない・
+# メタ発言の混じった文) はその場で直す。直せないもの (空・本文なし・なりすまし・メタ発言しかない) だけを
+# 作り直しの対象にし、作り直しは MAX_REGENERATIONS 回までに抑える。
+
+MAX_POST_CHARS = 140
+MAX_REGENERATIONS = 2
+
+# 前置き・相槌の定型句 (その言い回しと続く句読点だけを取り除く)
+META_PREFIX_PHRASES = [
+    "投稿内容：", "投稿内容:", "以下の投稿です", "以下の投稿", "承知しました", "かしこまりました", "理解しました", "不合格です",
+]
+# 投稿の途中に出てきてもメタ発言とみなす言い回し (その言い回しを含む文ごと取り除く)
+# 冒頭の定型句は debate_core.clean_post でも除去している
+META_PHRASES = [
+    "申し訳ありません", "システム上のエラー", "回答は無効", "この投稿は",
+    "AIとして", "AIです", "言語モデル", "アシスタントとして", "ロールプレイ", "なりきって", "プロンプト", "as an AI",
+]
+
+# 「私は〇〇だ」の〇〇 → その肩書きを名乗ってよい役職
+ROLE_CLAIMS = {
+    "louis": ["国王", "ルイ13世", "ルイ14世", "太陽王", "王"],
+    "minister": ["宰相", "枢機卿", "リシュリュー", "マザラン"],
+    "french_noble": ["フランス貴族", "貴族"],
+    "german_noble": ["ドイツ諸侯", "諸侯", "領邦君主"],
+    "huguenot": ["ユグノー"],
+    "luther": ["マルティン・ルター", "ルター"],
+    "leo": ["教皇", "レオ10世"],
+    "citizen": ["パリ市民", "市民", "民衆", "第三身分", "平民"],
+}
+# 互いの肩書きを名乗っても不自然でない役職の組
+CLAIM_ALIASES = {"french_noble": {"german_noble"}, "german_noble": {"french_noble"}}
+CLAIM_ROLES = {word: role for role, words in ROLE_CLAIMS.items() for word in words}
+
+def _alternation(words):
+    # 長い語を先に並べ、「国王」が「王」より先に当たるようにする
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+POST_PATTERN = re.compile(
+    # 肩書きの後は「である」などで節が切れるものだけを名乗りとみなす (「私は王だと思っていた」は名乗りではない)
+    r"(?P<claim>(?:私|わたし|わたくし|僕|俺|我輩|我|余|わし)(?:こそ|も)?[はが](?:この|偉大なる|フランスの|ローマの)?"
+    r"(?P<title>" + _alternation(CLAIM_ROLES) + r")"
+    r"(?=として|(?:である|だ|なり|です|なのだ|ぞ)?(?:[。、！!？?\s#]|$)))"
+    r"|(?P<prefix>" + _alternation(META_PREFIX_PHRASES) + r")[。、！!：:\s]*"
+    r"|(?P<meta>" + _alternation(META_PHRASES) + r")"
+    r"|(?P<tag>#[^\s#]+)"
+)
+SENTENCE_END = re.compile(r"[。！？!?\n]")
+REJECTED, REPAIRED = "rejected", "repaired"
+REASON_LABELS = {"empty": "空", "no_body": "本文なし", "meta": "メタ発言", "cross_talk": "なりすまし", "no_hashtag": "ハッシュタグなし", "too_long": "140字超"}
+
+def theme_hashtag(theme):
+    """テーマの最初の語からハッシュタグを作る (ハッシュタグのない投稿に補う)"""
+    tag = "".join(ch for ch in theme.split(" ")[0] if ch.isalnum())
+    return f"#{tag or '論争'}"
+
+def _sentence_span(text, start, end):
+    """start〜end を含む1文の範囲"""
+    head = max((m.end() for m in SENTENCE_END.finditer(text, 0, start)), default=0)
+    tail = SENTENCE_END.search(text, end)
+    return head, tail.end() if tail else len(text)
+
+def _trim(body, tags, limit):
+    """本文を文の切れ目で limit 文字以内に詰め、ハッシュタグを後ろに添える"""
+    tag_text = " ".join(tags)
+    while tags and len(tag_text) > limit // 2:
+        tags = tags[:-1]
+        tag_text = " ".join(tags)
+    room = limit - (len(tag_text) + 1 if tag_text else 0)
+    if len(body) > room:
+        cut = max((m.end() for m in SENTENCE_END.finditer(body, 0, room)), default=0)
+        # 切れ目が前の方にしかなければ、文の途中で切って省略記号を付ける
+        body = body[:cut] if cut >= room // 2 else body[:room - 1] + "…"
+    return f"{body.rstrip()} {tag_text}".strip()
+
+def validate_post(text, role, hashtag, limit=MAX_POST_CHARS):
+    """投稿を検証し、(直した投稿, [(理由, "repaired" / "rejected"), ...]) を返す (作り直しが必要なら投稿は空文字)"""
+    text = text.strip()
+    if not text:
+        return "", [("empty", REJECTED)]
+
+    tags = []
+    cut_spans = []  # 本文から取り除く範囲 (ハッシュタグ・前置きの定型句・メタ発言を含む文)
+    has_meta = False
+    for m in POST_PATTERN.finditer(text):
+        if m.group("tag"):
+            tags.append(m.group("tag"))
+            cut_spans.append(m.span())
+        elif m.group("prefix"):
+            has_meta = True
+            cut_spans.append(m.span())
+        elif m.group("meta"):
+            has_meta = True
+            cut_spans.append(_sentence_span(text, m.start(), m.end()))
+        elif role in ROLE_CLAIMS:
+            claimed = CLAIM_ROLES[m.group("title")]
+            if claimed != role and claimed not in CLAIM_ALIASES.get(role, ()):
+                return "", [("cross_talk", REJECTED)]
+
+    parts, pos = [], 0
+    for start, end in sorted(cut_spans):
+        parts.append(text[pos:start])
+        pos = max(pos, end)
+    parts.append(text[pos:])
+    body = re.sub(r"[ \t]+", " ", "".join(parts)).strip()
+    if not body:
+        # ハッシュタグや定型句しかない投稿は直しようがない
+        return "", [("meta" if has_meta else "no_body", REJECTED)]
+
+    problems = []
+    if not has_meta and tags and len(text) <= limit:
+        # 問題がなければ元の改行・空白の並びをそのまま返す
+        return text, problems
+    if has_meta:
+        problems.append(("meta", REPAIRED))
+
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        tags = [hashtag]
+        problems.append(("no_hashtag", REPAIRED))
+    result = f"{body} {' '.join(tags)}"
+    if len(result) > limit:
+        result = _trim(body, tags, limit)
+        problems.append(("too_long", REPAIRED))
+    elif len(text) > limit:
+        # 重複したハッシュタグを除くだけで収まった場合も、長すぎた投稿として数える
+        problems.append(("too_long", REPAIRED))
+    return result, problems
@@ -0,0 +1,179 @@
+"""ルーム配信: 1つの論争をプロセス内で1回だけ生成し、同じルームの全視聴者に配る
+
+先生のセッションがルームの論争を開始すると、エンジン用のスレッドが1投稿ずつ生成して
+リングバッファに積む。生徒のセッションは自分のカーソル以降の新着だけを読み出して描画する。
+
+    python rooms.py --viewers 30 --rounds 10   # 代役クライアントで複数視聴者をシミュレーション
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from context_builder import ContextBuilder
+from debate_core import pick_speaker, build_turn, build_context, complete_post, make_post_check, reading_pause
+from post_validator import MAX_REGENERATIONS
+
+# 連続でこの回数だけ生成に失敗したら、そのルームの論争を打ち切る
+MAX_CONSECUTIVE_ERRORS = 3
+ERROR_WAIT = 5.0
+
+class DebateRoom:
+    """ルームごとの論争エンジンと、投稿を配るリングバッファ"""
+
+    def __init__(self, room_id, capacity=200):
+        self.room_id = room_id
+        self._buffer = deque(maxlen=capacity)  # (seq, post)
+        self._last_seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.theme = None
+        self.rounds = 0
+        self.generated = 0
+        self.status = "idle"
+        self.error = None
+
+    # --- 配信側 ---
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, client, registry, theme, rounds, pace=reading_pause, rng=random):
+        """論争エンジンを起動する (すでに動いていれば何もしない)"""
+        with self._cond:
+            if self.is_running:
+                return False
+            self._stop.clear()
+            self.theme, self.rounds, self.generated = theme, rounds, 0
+            self.status, self.error = "running", None
+            self._thread = threading.Thread(
+                target=self._run, args=(client, registry, theme, rounds, pace, rng),
+                name=f"room-{self.room_id}", daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, client, registry, theme, rounds, pace, rng):
+        history = []
+        builder = ContextBuilder()
+        errors = 0
+        regenerations = 0
+        while self.generated < rounds and not self._stop.is_set():
+            char_id = pick_speaker(registry, theme, [p["role"] for p in history], self.generated, rng)
+            name, system_prompt = build_turn(registry, theme, char_id)
+            try:
+                check = make_post_check(registry, theme, char_id)
+                content = complete_post(client, build_context(system_prompt, history, builder), 150, check=check)
+            except Exception as e:
+                errors += 1
+                self.error = str(e)
+                if errors >= MAX_CONSECUTIVE_ERRORS:
+                    self.status = "error"
+                    self._notify()
+                    return
+                self._stop.wait(ERROR_WAIT)
+                continue
+            errors = 0
+            if not content:
+                # 検証で直せなかった投稿は作り直す (続けて上限を超えたら打ち切る)
+                regenerations += 1
+                if regenerations > MAX_REGENERATIONS:
+                    self.error = "投稿が検証を通りませんでした"
+                    self.status = "error"
+                    self._notify()
+                    return
+                continue
+            regenerations = 0
+            post = {"role": char_id, "name": name, "content": content}
+            history.append(post)
+            self.generated += 1
+            self.publish(post)
+            if self.generated < rounds:
+                # 視聴者が読み終えるまで次の投稿は出さない (生成自体は全視聴者で1回だけ)
+                self._stop.wait(pace(content) if callable(pace) else pace)
+        self.status = "stopped" if self._stop.is_set() else "finished"
+        self._notify()
+
+    def publish(self, post):
+        with self._cond:
+            self._last_seq += 1
+            self._buffer.append((self._last_seq, post))
+            self._cond.notify_all()
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    # --- 視聴側 ---
+    def read_since(self, cursor):
+        """cursor より新しい投稿と新しいカーソルを返す (バッファから溢れた古い投稿は読めない)"""
+        with self._cond:
+            return [post for seq, post in self._buffer if seq > cursor], self._last_seq
+
+    def wait_since(self, cursor, timeout=None):
+        """新着が届くか、論争が終わるか、timeout 秒経つまで待ってから read_since する"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._last_seq > cursor or self.status != "running", timeout)
+        return self.read_since(cursor)
+
+class RoomRegistry:
+    """プロセス内のルーム一覧 (app.py では st.cache_resource で1つだけ持つ)"""
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def get(self, room_id):
+        with self._lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = DebateRoom(room_id, self.capacity)
+            return self._rooms[room_id]
+
+# --- 代役クライアントでのシミュレーション ---
+def simulate(viewers=30, rounds=10, latency=0.05, theme=None):
+    """1ルームに複数の視聴者をつなぎ、全員が同じ投稿を同じ順で受け取り、生成が rounds 回で済むことを確かめる"""
+    from debate_core import PRESET_THEMES, build_character_registry
+    from mock_openai import MockOpenAI
+
+    client = MockOpenAI(latency=latency, seed=0)
+    registry = build_character_registry()
+    room = RoomRegistry().get("sim")
+    received = [[] for _ in range(viewers)]
+
+    def viewer(i):
+        cursor = 0
+        # 視聴者ごとに接続タイミングをずらす (途中参加でも先頭から読める)
+        time.sleep(random.uniform(0, latency * 3))
+        while True:
+            posts, cursor = room.wait_since(cursor, timeout=1.0)
+            received[i] += posts
+            if not room.is_running and not room.read_since(cursor)[0]:
+                return
+
+    room.start(client, registry, theme or PRESET_THEMES[0], rounds, pace=0.0)
+    threads = [threading.Thread(target=viewer, args=(i,)) for i in range(viewers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    expected = [p for _, p in room._buffer]
+    consistent = all(r == expected for r in received)
+    print(f"視聴者 {viewers} 人 / 投稿 {len(expected)} 件 / API 呼び出し {client.calls} 回 / 全員一致: {consistent}")
+    return consistent and client.calls == len(expected)
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="ルーム配信を代役クライアントでシミュレーションする")
+    parser.add_argument("--viewers", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    sys.exit(0 if simulate(args.viewers, args.rounds, args.latency) else 1)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール (debate_core など) をテストから import できるようにする
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
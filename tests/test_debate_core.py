@@ -0,0 +1,61 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from debate_core import PRESET_THEMES, build_character_registry, pick_speaker, run_debate
+from mock_openai import MockOpenAI
+from post_validator import MAX_POST_CHARS, MAX_REGENERATIONS
+
+@pytest.fixture(scope="module")
+def registry():
+    return build_character_registry()
+
+class EmptyClient:
+    """毎回空の投稿を返す代役 (作り直しの上限を確かめる)"""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=""))], usage=None)
+
+@pytest.mark.parametrize("theme", PRESET_THEMES)
+def test_run_debate_with_mock_client(registry, theme):
+    client = MockOpenAI(seed=0)
+    posts = run_debate(client, registry, theme, 8, random.Random(0))
+    assert len(posts) == 8
+    # 代役の投稿は検証を1回で通るので、API 呼び出しは投稿数と同じ
+    assert client.calls == 8
+    for post in posts:
+        assert post["name"] and post["content"]
+        assert len(post["content"]) <= MAX_POST_CHARS
+        assert "#" in post["content"]
+
+def test_run_debate_is_reproducible(registry):
+    theme = PRESET_THEMES[0]
+    first = run_debate(MockOpenAI(seed=1), registry, theme, 6, random.Random(3))
+    second = run_debate(MockOpenAI(seed=1), registry, theme, 6, random.Random(3))
+    assert first == second
+
+def test_run_debate_stops_after_regeneration_cap(registry):
+    client = EmptyClient()
+    assert run_debate(client, registry, PRESET_THEMES[0], 5, random.Random(0)) == []
+    assert client.calls == MAX_REGENERATIONS + 1
+
+def test_alternate_theme_takes_turns(registry):
+    # ナントの勅令廃止はユグノー → ルイ14世の交互制 (市民の割り込みは除く)
+    theme = next(t for t in PRESET_THEMES if "ナント" in t)
+    posts = run_debate(MockOpenAI(seed=0), registry, theme, 10, random.Random(0))
+    roles = [registry["entries"][p["role"]]["role"] for p in posts if p["role"] != "citizen"]
+    assert roles[0] == "huguenot"
+    assert all(a != b for a, b in zip(roles, roles[1:]))
+
+def test_pick_speaker_avoids_recent_speakers(registry):
+    theme = PRESET_THEMES[-1]
+    rng = random.Random(0)
+    # 直近2人 (ルターと教皇) を避けるので、残るドイツ諸侯が選ばれる
+    for _ in range(50):
+        assert pick_speaker(registry, theme, ["Luther1517", "Leo_X"], 1, rng) == "German_Noble"
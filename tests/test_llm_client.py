@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+import pytest
+
+from llm_client import CircuitOpenError, RateLimiter, ResilientClient, is_retryable, retry_after_seconds
+
+class APIError(Exception):
+    """OpenAI の APIStatusError と同じく status_code と response.headers を持つ例外"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(headers=headers)
+
+class StubClient:
+    """outcomes を順に返す (例外なら送出する) 代役"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class FakeSleep:
+    def __init__(self):
+        self.delays = []
+
+    def __call__(self, seconds):
+        self.delays.append(seconds)
+
+def make_client(outcomes, **kwargs):
+    sleep = FakeSleep()
+    stub = StubClient(outcomes)
+    kwargs.setdefault("base_delay", 0.5)
+    return ResilientClient(stub, sleep=sleep, **kwargs), stub, sleep
+
+def create(client):
+    return client.chat.completions.create(model="m", messages=[])
+
+def test_retryable_errors():
+    assert is_retryable(APIError(429))
+    assert is_retryable(APIError(503))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(APIError(401))
+    assert not is_retryable(APIError(400))
+    assert not is_retryable(ValueError())
+
+def test_retry_after_header():
+    assert retry_after_seconds(APIError(429, retry_after=3)) == 3.0
+    assert retry_after_seconds(APIError(429)) is None
+    assert retry_after_seconds(ValueError()) is None
+
+def test_retries_429_and_500_then_succeeds():
+    client, stub, sleep = make_client([APIError(429), APIError(500), "ok"])
+    assert create(client) == "ok"
+    assert stub.calls == 3
+    assert client.stats["retries"] == 2
+    assert client.stats["failures"] == 0
+    # ジッター付き指数バックオフ: 0〜base_delay × 2^attempt 秒
+    assert 0 <= sleep.delays[0] <= 0.5
+    assert 0 <= sleep.delays[1] <= 1.0
+
+def test_retry_after_sets_a_minimum_delay_capped_by_max_delay():
+    client, _, sleep = make_client([APIError(429, retry_after=4), APIError(429, retry_after=60), "ok"], max_delay=10.0)
+    assert create(client) == "ok"
+    assert sleep.delays[0] >= 4.0
+    assert sleep.delays[1] == 10.0
+
+def test_non_retryable_error_is_raised_immediately():
+    client, stub, sleep = make_client([APIError(401)])
+    with pytest.raises(APIError):
+        create(client)
+    assert stub.calls == 1
+    assert sleep.delays == []
+    assert client.stats["failures"] == 1
+
+def test_gives_up_after_max_retries():
+    client, stub, _ = make_client([APIError(500)], max_retries=2)
+    with pytest.raises(APIError):
+        create(client)
+    assert stub.calls == 3
+    assert client.stats["failures"] == 1
+
+def test_circuit_opens_after_consecutive_outages_and_short_circuits():
+    client, stub, _ = make_client([APIError(500)], max_retries=0, failure_threshold=2, reset_after=30.0)
+    for _ in range(2):
+        with pytest.raises(APIError):
+            create(client)
+    with pytest.raises(CircuitOpenError):
+        create(client)
+    # 回路が開いている間は API を呼ばない
+    assert stub.calls == 2
+    assert client.stats["short_circuits"] == 1
+
+def test_client_errors_do_not_open_the_circuit():
+    client, stub, _ = make_client([APIError(401)], max_retries=0, failure_threshold=2)
+    for _ in range(5):
+        with pytest.raises(APIError):
+            create(client)
+    assert stub.calls == 5
+    assert client.stats["short_circuits"] == 0
+
+def test_half_open_trial_closes_the_circuit_on_success(monkeypatch):
+    client, stub, _ = make_client([APIError(500), APIError(500), "ok"], max_retries=0, failure_threshold=2, reset_after=30.0)
+    now = [1000.0]
+    monkeypatch.setattr("llm_client.time.time", lambda: now[0])
+    for _ in range(2):
+        with pytest.raises(APIError):
+            create(client)
+    with pytest.raises(CircuitOpenError):
+        create(client)
+    # reset_after 秒経つと1件だけ試しに通し、成功すれば回路を閉じる
+    now[0] += 31.0
+    assert create(client) == "ok"
+    assert create(client) == "ok"
+    assert stub.calls == 4
+
+def test_half_open_trial_failure_reopens_the_circuit(monkeypatch):
+    client, stub, _ = make_client([APIError(500)], max_retries=0, failure_threshold=2, reset_after=30.0)
+    now = [1000.0]
+    monkeypatch.setattr("llm_client.time.time", lambda: now[0])
+    for _ in range(2):
+        with pytest.raises(APIError):
+            create(client)
+    now[0] += 31.0
+    with pytest.raises(APIError):
+        create(client)
+    with pytest.raises(CircuitOpenError):
+        create(client)
+    assert stub.calls == 3
+
+def test_rate_limiter_allows_a_burst_then_waits(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("llm_client.time.monotonic", lambda: now[0])
+    sleep = FakeSleep()
+    limiter = RateLimiter(rate=2.0, burst=2, sleep=sleep)
+    assert limiter.acquire() == 0.0
+    assert limiter.acquire() == 0.0
+    # バケットが空になったら、平均 2件/秒 になるよう順番に待たせる
+    assert limiter.acquire() == pytest.approx(0.5)
+    assert limiter.acquire() == pytest.approx(1.0)
+    assert sleep.delays == [pytest.approx(0.5), pytest.approx(1.0)]
+    now[0] += 10.0
+    assert limiter.acquire() == 0.0
+
+def test_rate_limited_calls_are_counted():
+    client, stub, _ = make_client(["ok"], rate_limiter=RateLimiter(rate=1.0, burst=1, sleep=lambda s: None))
+    create(client)
+    create(client)
+    assert stub.calls == 2
+    assert client.stats["rate_limited"] == 1
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+import message_store
+from message_store import LOCK_FILE, Message, MessageLog, SessionInUseError, list_sessions
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(message_store, "SEGMENT_SIZE", 3)
+
+def post(i):
+    return Message("citizen", "パリ市民", f"投稿{i} #三部会", "static/citizen.png")
+
+def segment_lines(log):
+    return [sum(1 for _ in open(os.path.join(log.root, f), encoding="utf-8"))
+            for f in sorted(os.listdir(log.root)) if f.endswith(".jsonl")]
+
+def test_segments_roll_over(tmp_path):
+    log = MessageLog("s1", root=tmp_path)
+    for i in range(7):
+        log.append(post(i))
+    assert log.total == 7
+    assert segment_lines(log) == [3, 3, 1]
+
+def test_reopened_log_continues_where_it_stopped(tmp_path):
+    log = MessageLog("s1", root=tmp_path)
+    for i in range(5):
+        log.append(post(i))
+    log.close()
+
+    reopened = MessageLog("s1", root=tmp_path)
+    assert reopened.total == 5
+    assert [m.content for m in reopened] == [f"投稿{i} #三部会" for i in range(5)]
+    reopened.append(post(5))
+    reopened.append(post(6))
+    assert segment_lines(reopened) == [3, 3, 1]
+
+def test_total_counts_the_lines_actually_on_disk(tmp_path):
+    # SEGMENT_SIZE 件ちょうどで閉じていないセグメントがあっても、件数をずらさない
+    root = tmp_path / "s1"
+    root.mkdir()
+    record = post(0).to_record()
+    for name, n in [("000000.jsonl", 5), ("000001.jsonl", 2)]:
+        (root / name).write_text("".join(json.dumps(record) + "\n" for _ in range(n)), encoding="utf-8")
+    log = MessageLog("s1", root=tmp_path)
+    assert log.total == 7
+    log.append(post(1))
+    assert segment_lines(log) == [5, 3]
+
+def test_recent_reads_older_posts_from_disk(tmp_path):
+    log = MessageLog("s1", root=tmp_path, tail=2)
+    for i in range(7):
+        log.append(post(i))
+    assert len(log) == 2
+    assert [m.content for m in log.recent(5)] == [f"投稿{i} #三部会" for i in range(2, 7)]
+    assert len(log.recent(100)) == 7
+    assert log.recent(0) == []
+
+def test_second_writer_is_refused(tmp_path):
+    first = MessageLog("s1", root=tmp_path, owner="tab1")
+    with pytest.raises(SessionInUseError):
+        MessageLog("s1", root=tmp_path, owner="tab2")
+    first.append(post(0))
+    assert first.total == 1
+
+def test_log_of_a_disconnected_writer_is_taken_over(tmp_path):
+    first = MessageLog("s1", root=tmp_path, owner="tab1")
+    first.append(post(0))
+    second = MessageLog("s1", root=tmp_path, owner="tab2", is_live=lambda owner: False)
+    second.append(post(1))
+    assert second.total == 2
+    # 引き継がれた側は、もう書き込めない
+    with pytest.raises(SessionInUseError):
+        first.append(post(2))
+    assert segment_lines(second) == [2]
+
+def test_close_releases_the_lock(tmp_path):
+    log = MessageLog("s1", root=tmp_path, owner="tab1")
+    log.close()
+    assert not os.path.exists(os.path.join(log.root, LOCK_FILE))
+    MessageLog("s1", root=tmp_path, owner="tab2")
+
+def test_meta_is_saved_with_the_log(tmp_path):
+    log = MessageLog("s1", root=tmp_path)
+    log.meta["room_cursor"] = {"room": "r1", "seq": 4}
+    log.save_meta()
+    log.close()
+    assert MessageLog("s1", root=tmp_path).meta == {"room_cursor": {"room": "r1", "seq": 4}}
+
+def test_sessions_without_posts_are_not_listed(tmp_path):
+    MessageLog("empty", root=tmp_path)
+    MessageLog("s1", root=tmp_path).append(post(0))
+    assert [s["id"] for s in list_sessions(tmp_path)] == ["s1"]
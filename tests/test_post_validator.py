@@ -0,0 +1,77 @@
+import pytest
+
+from post_validator import MAX_POST_CHARS, REJECTED, REPAIRED, theme_hashtag, validate_post
+
+TAG = "#全国三部会の停止"
+
+def reasons(problems):
+    return {reason: action for reason, action in problems}
+
+def test_valid_post_is_returned_unchanged():
+    text = "貴族どもの特権、断じて許さぬ！\n王よ、我らを救いたまえ。 #三部会"
+    assert validate_post(text, "citizen", TAG) == (text, [])
+
+def test_missing_hashtag_is_added():
+    text, problems = validate_post("税が重すぎる。パンをよこせ！", "citizen", TAG)
+    assert text == f"税が重すぎる。パンをよこせ！ {TAG}"
+    assert reasons(problems) == {"no_hashtag": REPAIRED}
+
+def test_long_post_is_trimmed_at_a_sentence_boundary():
+    body = "あ" * 80 + "。" + "い" * 80 + "。"
+    text, problems = validate_post(f"{body} #三部会 #税", "citizen", TAG)
+    assert len(text) <= MAX_POST_CHARS
+    assert text == "あ" * 80 + "。 #三部会 #税"
+    assert reasons(problems) == {"too_long": REPAIRED}
+
+def test_long_post_without_boundary_is_cut_with_ellipsis():
+    text, problems = validate_post("い" * 200, "citizen", TAG)
+    assert len(text) == MAX_POST_CHARS
+    assert text.endswith(f"… {TAG}")
+    assert reasons(problems) == {"no_hashtag": REPAIRED, "too_long": REPAIRED}
+
+def test_long_post_fixed_by_deduping_hashtags_is_counted():
+    text, problems = validate_post("税が重い" + "#a" * 80, "citizen", TAG)
+    assert text == "税が重い #a"
+    assert reasons(problems) == {"too_long": REPAIRED}
+
+@pytest.mark.parametrize("text, expected", [
+    ("投稿内容：王権は神授である #王権", "王権は神授である #王権"),
+    ("承知しました。税を下げよ！ #税", "税を下げよ！ #税"),
+    ("AIとしてお答えします。税は重すぎる！ #税", "税は重すぎる！ #税"),
+])
+def test_meta_speech_is_repaired(text, expected):
+    repaired, problems = validate_post(text, "louis", TAG)
+    assert repaired == expected
+    assert reasons(problems) == {"meta": REPAIRED}
+
+@pytest.mark.parametrize("text, reason", [
+    ("", "empty"),
+    ("   ", "empty"),
+    ("#a #b #c", "no_body"),
+    ("AIとしてお答えします。 #x", "meta"),
+    ("承知しました。 #x", "meta"),
+])
+def test_unrepairable_posts_are_rejected(text, reason):
+    assert validate_post(text, "citizen", TAG) == ("", [(reason, REJECTED)])
+
+@pytest.mark.parametrize("text, role", [
+    ("余は国王である。パンをよこせ！ #三部会", "citizen"),
+    ("私は教皇だ、ひれ伏せ #宗教改革", "luther"),
+    ("私は国王として命じる #フロンド", "minister"),
+])
+def test_cross_talk_is_rejected(text, role):
+    assert validate_post(text, role, TAG) == ("", [("cross_talk", REJECTED)])
+
+@pytest.mark.parametrize("text, role", [
+    ("余は国王である。朕は国家なり #三部会", "louis"),
+    ("私はドイツ諸侯だ。 #宗教改革", "french_noble"),
+    ("私は王に救済を求める。 #三部会", "citizen"),
+    ("私は王だと思っていた民衆です #三部会", "citizen"),
+    ("私は教皇だ #x", "other"),
+])
+def test_non_claims_and_own_titles_pass(text, role):
+    assert validate_post(text, role, TAG) == (text, [])
+
+def test_theme_hashtag_uses_first_word():
+    assert theme_hashtag("全国三部会の停止 (1614年・身分制の対立)") == TAG
+    assert theme_hashtag("(?)") == "#論争"
@@ -0,0 +1,54 @@
+import random
+import threading
+
+from debate_core import PRESET_THEMES, build_character_registry
+from mock_openai import MockOpenAI
+from rooms import DebateRoom, RoomRegistry
+
+def watch(room, received, cursor=0):
+    """視聴者1人分: 論争が終わって読み切るまで新着を受け取る"""
+    while True:
+        posts, cursor = room.wait_since(cursor, timeout=1.0)
+        received += posts
+        if not room.is_running and not room.read_since(cursor)[0]:
+            return
+
+def test_all_viewers_receive_the_same_posts():
+    client = MockOpenAI(seed=0)
+    room = RoomRegistry().get("test")
+    received = [[] for _ in range(8)]
+    room.start(client, build_character_registry(), PRESET_THEMES[0], 6, pace=0.0, rng=random.Random(0))
+    threads = [threading.Thread(target=watch, args=(room, r)) for r in received]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    expected = [post for _, post in room._buffer]
+    assert len(expected) == 6
+    assert all(r == expected for r in received)
+    # 視聴者が何人いても生成は1投稿につき1回だけ
+    assert client.calls == 6
+    assert room.status == "finished"
+
+def test_late_viewer_reads_from_the_start():
+    room = DebateRoom("late")
+    room.start(MockOpenAI(seed=0), build_character_registry(), PRESET_THEMES[1], 4, pace=0.0)
+    room._thread.join(timeout=10)
+    received = []
+    watch(room, received)
+    assert received == [post for _, post in room._buffer]
+
+def test_read_since_skips_posts_dropped_from_the_buffer():
+    room = DebateRoom("small", capacity=3)
+    for i in range(5):
+        room.publish({"role": "citizen", "name": "市民", "content": str(i)})
+    posts, cursor = room.read_since(0)
+    assert [p["content"] for p in posts] == ["2", "3", "4"]
+    assert cursor == 5
+    assert room.read_since(cursor) == ([], 5)
+
+def test_registry_returns_the_same_room():
+    registry = RoomRegistry()
+    assert registry.get("a") is registry.get("a")
+    assert registry.get("a") is not registry.get("b")